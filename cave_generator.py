@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import constants
+import gridutil
+
+from dungeon_generator import Generator
+from dungeon_generator import GENERATOR_VERSION
+from dungeon_generator import FAIL_ROOM_COUNT
+from dungeon_generator import AreaTypes
+from dungeon_generator import Room
+from dungeon_generator import FLOOR
+from dungeon_generator import BOSS_FLOOR
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+"""
+Number of True tiles among the 8 neighbours of each tile of the 2d boolean array 'mask'
+(tiles outside the array count as True, so caves close up at the map edges)
+"""
+def neighbour_count(mask):
+    h, w = mask.shape
+    padded = np.ones((h + 2, w + 2), dtype=np.uint8)
+    padded[1:-1, 1:-1] = mask
+
+    count = np.zeros(mask.shape, dtype=np.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            if dy != 1 or dx != 1:
+                count += padded[dy:dy + h, dx:dx + w]
+    return count
+
+"""
+Cave levels from a cellular automaton instead of rooms and corridors. Implements the same
+interface as Generator (grid, level, room_list, gen_level, test_level, export_level...):
+the 'rooms' are squares of the cave used to place the player, Beowulf and monsters
+"""
+class CaveGenerator(Generator):
+    def __init__(self, width=64, height=64, max_rooms=15, min_room_xy=5, max_room_xy=10, seed=None,
+                 profile=False, fill=constants.CAVE_FILL, steps=constants.CAVE_STEPS,
+                 room_size=constants.CAVE_ROOM_SIZE, **kwargs):
+        # share of tiles starting as rock, automaton steps, side of the squares used as rooms
+        self.fill = fill
+        self.steps = steps
+        self.room_size = room_size
+
+        Generator.__init__(self, width, height, max_rooms, min_room_xy, max_room_xy, seed, profile)
+
+    def params(self):
+        return (GENERATOR_VERSION, 'caves', self.width, self.height, self.fill, self.steps, self.room_size)
+
+    def gen_level(self):
+        stats = self.stats
+        if stats:
+            stats.begin_run()
+
+        self.clear_lists()
+        self.init_lists()
+
+        # random rock, from a numpy generator seeded by our own rng so reseed() still works
+        nprng = np.random.default_rng(self.rng.getrandbits(64))
+        rock = nprng.random((self.height, self.width)) < self.fill
+        if stats:
+            stats.lap('fill')
+
+        # a tile becomes rock when most of its neighbourhood is rock
+        for i in range(self.steps):
+            rock = (neighbour_count(rock) + rock) >= 5
+        rock[0, :] = rock[-1, :] = rock[:, 0] = rock[:, -1] = True
+        if stats:
+            stats.lap('automaton')
+
+        # keep only the largest open cave
+        labels, count = gridutil.label_regions(~rock)
+        if count == 0:
+            self.failure = FAIL_ROOM_COUNT
+            return False
+        largest = np.bincount(labels.ravel())[1:].argmax() + 1
+        cave = labels == largest
+        self.grid[cave] = FLOOR
+        if stats:
+            stats.lap('largest_cave')
+
+        self.gen_cave_rooms(cave)
+        if stats:
+            stats.lap('cave_rooms')
+
+        # boss rooms keep their look: floor inside them is boss floor
+        for room in self.room_list:
+            if room.rtype is AreaTypes.BOSS:
+                area = self.grid[room.y:room.y + room.h, room.x:room.x + room.w]
+                area[area == FLOOR] = BOSS_FLOOR
+        self.paint_walls()
+
+        valid = self.test_level()
+        if stats:
+            stats.lap('test_level')
+            stats.count('rooms', len(self.room_list))
+            if not valid:
+                stats.count('failed_' + str(self.failure))
+        return valid
+
+    """
+    Split the map into room_size squares and make a Room of each square with enough cave in it.
+    The room with most cave near the map's left edge is the player's, the rooms around the
+    one furthest from it hold the boss
+    """
+    def gen_cave_rooms(self, cave):
+        size = self.room_size
+        rows = self.height // size
+        cols = self.width // size
+
+        # open tiles per square, summed with one reshape
+        blocks = cave[:rows * size, :cols * size].reshape(rows, size, cols, size).sum(axis=(1, 3))
+        for by, bx in zip(*np.nonzero(blocks >= size * size // 4)):
+            self.add_room(Room(int(bx) * size, int(by) * size, size, size))
+
+        if len(self.room_list) < 2:
+            return
+
+        def dist2(a, b):
+            return (a.center()[0] - b.center()[0]) ** 2 + (a.center()[1] - b.center()[1]) ** 2
+
+        # player at the left, boss area around the room furthest from it
+        p_room = min(self.room_list, key=lambda r: (r.x, -blocks[r.y // size, r.x // size]))
+        p_room.rtype = AreaTypes.PLAYER
+        b_room = max(self.room_list, key=lambda r: dist2(r, p_room))
+        others = [room for room in self.room_list if room is not p_room]
+        for room in sorted(others, key=lambda r: dist2(r, b_room))[:4]:
+            room.rtype = AreaTypes.BOSS
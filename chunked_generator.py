@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+import random
+
+import numpy as np
+
+import constants
+
+from dungeon_generator import Generator
+from dungeon_generator import Corridor
+from dungeon_generator import Room
+from dungeon_generator import STONE
+from dungeon_generator import TILE_BLOCKED
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+"""
+One generated square of a ChunkedLevel: its tile grid and its rooms (in map coordinates)
+"""
+class Chunk:
+    def __init__(self, cx, cy, x, y, grid, room_list):
+        self.cx = cx
+        self.cy = cy
+        self.x = x
+        self.y = y
+        self.grid = grid
+        self.room_list = room_list
+
+    def __repr__(self):
+        return '<Chunk {0},{1} at x:{2} y:{3} rooms:{4}>'.format(self.cx, self.cy, self.x, self.y, len(self.room_list))
+
+"""
+Very large map split into fixed size chunks that are each generated the first time
+something asks for one of their tiles. Neighbouring chunks agree on a 'door' tile on
+their shared edge, derived from the level seed, and both carve a corridor to it, so
+chunks connect no matter which one is generated first. Each chunk is checked and repaired
+on its own (Generator.connect_rooms), which keeps the whole map one connected area.
+"""
+class ChunkedLevel:
+    def __init__(self, width, height, chunk_size=constants.CHUNK_SIZE, rooms_per_chunk=constants.CHUNK_ROOMS,
+                 min_room_xy=constants.ROOM_MIN_SIZE, max_room_xy=constants.ROOM_MAX_SIZE, seed=None):
+        if chunk_size < max_room_xy + 8:
+            raise ValueError('Chunks must be at least max_room_xy + 8 tiles wide!', chunk_size)
+        if width < chunk_size or height < chunk_size:
+            raise ValueError('Map must be at least one chunk in size!', (width, height))
+
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.rooms_per_chunk = rooms_per_chunk
+        self.min_room_xy = min_room_xy
+        self.max_room_xy = max_room_xy
+
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+
+        # the last row and column of chunks also take any leftover tiles
+        self.chunks_x = width // chunk_size
+        self.chunks_y = height // chunk_size
+
+        # {(cx, cy): Chunk} for chunks generated so far
+        self.chunks = {}
+
+    ### CHUNK LOOKUP ###
+    def chunk_of(self, x, y):
+        return (min(x // self.chunk_size, self.chunks_x - 1), min(y // self.chunk_size, self.chunks_y - 1))
+
+    def chunk_bounds(self, cx, cy):
+        x = cx * self.chunk_size
+        y = cy * self.chunk_size
+        w = self.width - x if cx == self.chunks_x - 1 else self.chunk_size
+        h = self.height - y if cy == self.chunks_y - 1 else self.chunk_size
+        return (x, y, w, h)
+
+    """
+    Return the Chunk at chunk coordinates cx, cy, generating it first if needed
+    """
+    def get_chunk(self, cx, cy):
+        chunk = self.chunks.get((cx, cy))
+        if chunk is None:
+            chunk = self.gen_chunk(cx, cy)
+            self.chunks[(cx, cy)] = chunk
+        return chunk
+
+    """
+    Generate every chunk within radius tiles of x, y (call as the camera or an AI target approaches)
+    """
+    def materialize_near(self, x, y, radius):
+        cx1, cy1 = self.chunk_of(max(x - radius, 0), max(y - radius, 0))
+        cx2, cy2 = self.chunk_of(min(x + radius, self.width - 1), min(y + radius, self.height - 1))
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                self.get_chunk(cx, cy)
+
+    ### TILE QUERIES ###
+    def tile_code(self, x, y):
+        chunk = self.get_chunk(*self.chunk_of(x, y))
+        return chunk.grid[y - chunk.y, x - chunk.x]
+
+    def is_blocked(self, x, y):
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return True
+        return TILE_BLOCKED[self.tile_code(x, y)]
+
+    """
+    Return a (h, w) grid of tile codes for a window of the map, generating the chunks it touches.
+    Tiles outside the map are STONE
+    """
+    def window(self, x, y, w, h):
+        out = np.full((h, w), STONE, dtype=np.uint8)
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, self.width), min(y + h, self.height)
+        if x1 >= x2 or y1 >= y2:
+            return out
+
+        cx1, cy1 = self.chunk_of(x1, y1)
+        cx2, cy2 = self.chunk_of(x2 - 1, y2 - 1)
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                chunk = self.get_chunk(cx, cy)
+                ch, cw = chunk.grid.shape
+                # overlap of this chunk and the window, in map coordinates
+                ox1, oy1 = max(x1, chunk.x), max(y1, chunk.y)
+                ox2, oy2 = min(x2, chunk.x + cw), min(y2, chunk.y + ch)
+                out[oy1 - y:oy2 - y, ox1 - x:ox2 - x] = chunk.grid[oy1 - chunk.y:oy2 - chunk.y, ox1 - chunk.x:ox2 - chunk.x]
+        return out
+
+    """
+    Rooms of all chunks generated so far
+    """
+    @property
+    def room_list(self):
+        return [room for chunk in self.chunks.values() for room in chunk.room_list]
+
+    ### GENERATION ###
+    """
+    Random number generator for one named part of the level, the same for a given seed
+    """
+    def part_rng(self, *part):
+        return random.Random(repr((self.seed,) + part))
+
+    """
+    Return the door tile (x, y) on the edge between chunk cx, cy and its neighbour to the
+    right ('v'ertical edge) or below ('h'orizontal edge), or None if there is no neighbour
+    """
+    def door(self, edge, cx, cy):
+        x, y, w, h = self.chunk_bounds(cx, cy)
+        rng = self.part_rng('door', edge, cx, cy)
+        if edge == 'v':
+            if cx + 1 >= self.chunks_x:
+                return None
+            return (x + w - 1, y + rng.randint(2, h - 3))
+        else:
+            if cy + 1 >= self.chunks_y:
+                return None
+            return (x + rng.randint(2, w - 3), y + h - 1)
+
+    """
+    Doors on each side of chunk cx, cy as a list of (door_x, door_y, side) in map coordinates,
+    where the door tile is the chunk's own border tile on that side
+    """
+    def chunk_doors(self, cx, cy):
+        doors = []
+        right = self.door('v', cx, cy)
+        if right:
+            doors.append((right[0], right[1], 'right'))
+        bottom = self.door('h', cx, cy)
+        if bottom:
+            doors.append((bottom[0], bottom[1], 'bottom'))
+        if cx > 0:
+            left = self.door('v', cx - 1, cy)
+            doors.append((left[0] + 1, left[1], 'left'))
+        if cy > 0:
+            top = self.door('h', cx, cy - 1)
+            doors.append((top[0], top[1] + 1, 'top'))
+        return doors
+
+    def gen_chunk(self, cx, cy):
+        x, y, w, h = self.chunk_bounds(cx, cy)
+        gen = Generator(width=w, height=h, max_rooms=self.rooms_per_chunk,
+                        min_room_xy=self.min_room_xy, max_room_xy=self.max_room_xy,
+                        seed=self.part_rng('chunk', cx, cy).getrandbits(32))
+
+        # rooms, using the whole chunk as one region
+        for i in range(self.rooms_per_chunk * 4):
+            room = gen.gen_room_in_region(0, 0, w, h)
+            if not gen.room_overlapping(room):
+                gen.add_room(room)
+                if len(gen.room_list) >= self.rooms_per_chunk:
+                    break
+        if not gen.room_list:
+            # always leave a small hub for the doors to reach
+            gen.add_room(Room(w // 2 - 1, h // 2 - 1, 3, 3))
+
+        # chain the rooms together from left to right
+        gen.room_list.sort(key=lambda r: r.x)
+        for a, b in zip(gen.room_list, gen.room_list[1:]):
+            gen.join_rooms(a, b)
+
+        # run a corridor from each door straight into the chunk, then turn to the closest room
+        for door_x, door_y, side in self.chunk_doors(cx, cy):
+            dx, dy = door_x - x, door_y - y
+            room = min(gen.room_list, key=lambda r: abs(r.center()[0] - dx) + abs(r.center()[1] - dy))
+            rx, ry = room.center()
+            if side in ('left', 'right'):
+                points = [(dx, dy), (rx, dy), (rx, ry)]
+            else:
+                points = [(dx, dy), (dx, ry), (rx, ry)]
+            gen.corridor_list.append(Corridor(points))
+
+        gen.paint_rooms()
+        gen.paint_corridors()
+        gen.paint_walls()
+        # corridors can still leave rooms cut off, join them up before any obstacles go in
+        # (every door corridor ends in a room, so the doors are connected too)
+        if not gen.connect_rooms():
+            logging.warning('Chunk %s,%s has unreachable rooms: %s', cx, cy, gen.unreachable)
+        gen.paint_obstacles()
+
+        # move rooms to map coordinates
+        for room in gen.room_list:
+            room.x += x
+            room.y += y
+            for o in room.obstacles:
+                o.x += x
+                o.y += y
+
+        logging.debug('Generated chunk %s,%s with %s rooms', cx, cy, len(gen.room_list))
+        return Chunk(cx, cy, x, y, gen.grid, gen.room_list)
+
+    def __repr__(self):
+        return 'Chunks: {0}/{1}, Dimensions: {2}x{3}, Seed: {4}'.format(
+            len(self.chunks), self.chunks_x * self.chunks_y, self.width, self.height, self.seed)
@@ -45,6 +45,33 @@ BIGROOM_MAX_W = 12
 BIGROOM_MIN_H = 8
 BIGROOM_MAX_H = 12
 
+# layout of generated levels: 'rooms' (rooms and corridors) or 'caves' (cellular automaton)
+LEVEL_STYLE = 'rooms'
+
+# caves: share of tiles starting as rock, automaton steps, side of the squares used as rooms
+CAVE_FILL = 0.45
+CAVE_STEPS = 4
+CAVE_ROOM_SIZE = 8
+
+# chance for a room to be stamped from a prefab template (see prefabs.py)
+PREFAB_CHANCE = 0.15
+
+# background level generation (number of levels kept ready, worker processes)
+LEVEL_SUPPLY_SIZE = 3
+LEVEL_SUPPLY_WORKERS = 1
+
+# set to an int to replay the same level layout every game
+LEVEL_SEED = None
+# where levels generated from a seed are cached
+LEVEL_CACHE_DIR = 'level_cache'
+
+# chunked generation of very large maps (tiles per chunk side, rooms per chunk)
+CHUNK_SIZE = 64
+CHUNK_ROOMS = 12
+
+# floors in the dungeon, Beowulf waits on the last one
+FLOOR_COUNT = 3
+
 # monster qty
 MONSTER_COUNT = 46  #26
 MONSTER_SPECIAL = 0.4
@@ -71,6 +98,9 @@ FOV_LIGHT_WALLS = True
 FOV_BASIC = 'BASIC'
 FOV_ALGO_BAD = 'BASIC'
 FOV_RADIUS_BAD = 5
+FOV_MONSTER = 'PERMISSIVE'
+# monster fields of view remembered between turns (see fov_cache.py)
+FOV_CACHE_SIZE = 256
 
 # launcher settings
 LIMIT_FPS = 20  #20 frames-per-second maximum
@@ -125,6 +155,7 @@ INVENTORY = 'inventory'
 WAIT = 'waited'
 PICK_UP = 'picked up'
 DROP = 'drop'
+DESCEND = 'descended'
 MOUSE_MOVED = 'mouse'
 
 INPUT_REPEAT_DELAY = 1.0 / 10.0
@@ -51,6 +51,9 @@ def inventory(user_input):
 def drop(user_input):
     return user_input.type == 'KEYDOWN' and user_input.text == 'd'
     
+def descend(user_input):
+    return user_input.type == 'KEYDOWN' and user_input.text == '>'
+    
     
 """
 Displaying information
@@ -4,6 +4,7 @@
 import types
 
 import tcod
+import tcod.path
 import tdl
 
 import constants
@@ -15,9 +16,15 @@ from random import choice
 from random import random
 from random import uniform as randfloat
 
-from dungeon_generator import AreaTypes
-from dungeon_generator import TileTypes
-from dungeon_generator import Generator
+from tilemap import TileMap
+from fov_cache import FovCache
+import fov
+
+from level_supply import default_generator_args
+from level_supply import make_generator
+from level_cache import LevelCache
+
+import floors
 
 import numpy as np
 
@@ -50,46 +57,37 @@ class States(Enum):
 # global dungeon instance
 _dungeon = None
                 
-"""
-Map tile without a GameObject
-"""
-class Tile:
-    #a tile of the map and its properties
-    def __init__(self, blocked, block_sight=None, color_light=None, color_dark=None):
-        self.blocked = blocked
- 
-        #all tiles start unexplored
-        self.explored = False
- 
-        #by default, if a tile is blocked, it also blocks sight
-        if block_sight is None: 
-            block_sight = blocked
-        self.block_sight = block_sight
-        
-        self.color_light = color_light
-        self.color_dark = color_dark
-
 """
 A consumable Item that can be picked up and used by the player
 """
 class Item:
+    # entity classes use __slots__: no per-instance __dict__, there can be thousands of them
+    __slots__ = ('use_function', '_owner', 'inv_description')
+    
     def __init__(self, use_function=None, inv_description=''):
         self.use_function = use_function
-        self.owner = None
+        self._owner = None
         self.inv_description = inv_description
+        
+    # the GameObject carrying this item on the map (a property so Weapon can make it lazily;
+    # pickling saves the _owner slot and never runs the property)
+    @property
+    def owner(self):
+        return self._owner
+        
+    @owner.setter
+    def owner(self, value):
+        self._owner = value
  
     def drop(self, obj_dropper):
         #add to the map and remove from the player's inventory. also, place it at the player's coordinates
-        _dungeon.objects.append(self.owner)
+        self.owner.move_to(obj_dropper.x, obj_dropper.y)
+        _dungeon.add_object(self.owner)
         if obj_dropper == _dungeon.player:
             _dungeon.inventory.remove(self)
         elif self == obj_dropper.item:
             obj_dropper.item = None
-            
-        self.owner.x = obj_dropper.x
-        self.owner.y = obj_dropper.y
         
-        _dungeon.game.sort_obj_at(self.owner.x, self.owner.y)
         _dungeon.game.message(obj_dropper.name + ' dropped ' + self.owner.name + '.', colors.yellow)
     
     def name(self):
@@ -134,15 +132,20 @@ An object on the map with an x,y position.  can contain ai, fighers, item, or 'c
 class GameObject:
     #this is a generic object: the player, a monster, an item, the stairs...
     #it's always represented by a character on screen.
+    __slots__ = ('on_map', '_x', '_y', 'char', 'color', 'name', '_blocks', 'fighter', 'ai', 'item')
+    
     def __init__(self, dungeon, x, y, char, name, color, blocks=False, 
                  fighter=None, ai=None, item=None):
                  
-        self.x = x
-        self.y = y
+        # set by Dungeon.add_object / remove_object, only objects on the map count as occupying tiles
+        self.on_map = False
+        
+        self._x = x
+        self._y = y
         self.char = char
         self.color = color
         self.name = name
-        self.blocks = blocks
+        self._blocks = blocks
         self.fighter = fighter
  
         if self.fighter:  #let the fighter component know who owns it
@@ -160,6 +163,46 @@ class GameObject:
         if self.uses_turns():
             dungeon.schedule_turn(self.base_speed()+randint(0,3), self)
             
+    # position and blocking keep the dungeon's tile index and occupancy grid up to date while on the map
+    @property
+    def x(self):
+        return self._x
+        
+    @x.setter
+    def x(self, value):
+        self.move_to(value, self._y)
+        
+    @property
+    def y(self):
+        return self._y
+        
+    @y.setter
+    def y(self, value):
+        self.move_to(self._x, value)
+        
+    @property
+    def blocks(self):
+        return self._blocks
+        
+    @blocks.setter
+    def blocks(self, value):
+        if self.on_map and self._blocks:
+            _dungeon.unoccupy(self)
+        self._blocks = value
+        if self.on_map and self._blocks:
+            _dungeon.occupy(self)
+        
+    """
+    Set x and y together
+    """
+    def move_to(self, x, y):
+        if self.on_map:
+            _dungeon.unplace(self)
+        self._x = x
+        self._y = y
+        if self.on_map:
+            _dungeon.place(self)
+        
     def base_speed(self):
         if self.fighter:
             return self.fighter.move_speed()
@@ -183,6 +226,8 @@ Healing item
 """
 class Heart(GameObject):
     #chr(173) - the 'drumstick'
+    __slots__ = ()
+    
     def __init__(self, x=0, y=0):
         itm = Item(cast_heal, inv_description='(+20 HP)')
         GameObject.__init__(self, _dungeon, x, y, chr(3), constants.PART_HEALING,
@@ -194,6 +239,8 @@ class Heart(GameObject):
 Power bonus item
 """
 class Muscle(GameObject):
+    __slots__ = ()
+    
     def __init__(self, x=0, y=0):
         itm = Item(bonus_power, inv_description='(+Strength,-Speed,+2 HP)')
         GameObject.__init__(self, _dungeon, x, y, '&', constants.PART_POWER,
@@ -203,12 +250,16 @@ class Muscle(GameObject):
 Speed bonus item
 """
 class Legs(GameObject):
+    __slots__ = ()
+    
     def __init__(self, x=0, y=0):
         itm = Item(bonus_speed, inv_description='(+Speed,-Strength,+2 HP)')
         GameObject.__init__(self, _dungeon, x, y, chr(28), constants.PART_SPEED,
             colors.light_flame, item=itm)
             
 class Eyes(GameObject):
+    __slots__ = ()
+    
     def __init__(self, x=0, y=0):
         itm = Item(bonus_vision, inv_description='(+Vision,-Toughness,+8 HP)')
         GameObject.__init__(self, _dungeon, x, y, chr(248), constants.PART_FOV,
@@ -218,17 +269,31 @@ class Eyes(GameObject):
 Defense bonus item
 """
 class Torso(GameObject):
+    __slots__ = ()
+    
     def __init__(self, x=0, y=0):
         itm = Item(bonus_defense, inv_description='(+Toughness,-Vision,+2 HP)')
         GameObject.__init__(self, _dungeon, x, y, '#', constants.PART_DEFENSE,
             colors.light_flame, item=itm)
        
+"""
+Stairs down to the next floor
+"""
+class Stairs(GameObject):
+    __slots__ = ()
+    
+    def __init__(self, dungeon, x, y):
+        GameObject.__init__(self, dungeon, x, y, '>', 'stairs down', colors.white)
+
 
 """
 A creature's combat representation: hp, power, attack, take_dmg etc
 """
 class Fighter:
     #combat-related properties and methods (monster, player, NPC).
+    __slots__ = ('max_hp', 'hp', 'defense', 'power', 'death_function', 'owner', 'died', 'weapon',
+                 'speed', 'last_turn', 'last_health_change', 'lhc_turns')
+    
     def __init__(self, hp, defense, power, speed=16, death_function=None, weapon=None):
         self.max_hp = hp
         self.hp = hp
@@ -330,6 +395,8 @@ class Fighter:
 Fighter that sets owners color based on health thresholds
 """
 class Fighter_hpcolor(Fighter):
+    __slots__ = ('thresh_colors',)
+    
     def __init__(self, hp, defense, power, speed=16, death_function=None, weapon=None, health_colors=None):
         Fighter.__init__(self, hp, defense, power, speed, death_function, weapon)
         self.thresh_colors = health_colors
@@ -355,6 +422,8 @@ class Fighter_hpcolor(Fighter):
 Player GameObject
 """
 class Player(GameObject):
+    __slots__ = ('fov',)
+    
     def __init__(self, dungeon, x, y):
     
         #create object representing the player
@@ -415,6 +484,8 @@ Weak enemy (GameObject)
 """
 class Scout(GameObject):
     #Scout monster GameObject
+    __slots__ = ('drop_objects',)
+    
     def __init__(self, dungeon, x, y):
         #barb_ai = BasicMonster(dungeon, fov_algo=constants.FOV_ALGO_BAD, 
             #vision_range=constants.FOV_RADIUS_BAD)
@@ -449,10 +520,9 @@ class Scout(GameObject):
         if self.drop_objects:
             for itm in self.drop_objects:
                 # give it this position
-                itm.x = self.x
-                itm.y = self.y
+                itm.move_to(self.x, self.y)
                 # add to dungeon
-                _dungeon.objects.append(itm)
+                _dungeon.add_object(itm)
             # announce
             _dungeon.game.message('You see ' + format_list([itm.name for itm in self.drop_objects]) + ' in ' + self.name + "'s corpse!", colors.light_orange)
                 
@@ -464,8 +534,8 @@ class Scout(GameObject):
         self.fighter = None
         self.ai = None
         
-        # sort this tile properly
-        _dungeon.game.sort_obj_at(self.x, self.y)
+        # now a corpse: sort this tile properly
+        _dungeon.sort_tile(self.x, self.y)
         
         # now re-count enemies (since we've set our Fighter to None)
         _dungeon.count_enemies()
@@ -475,6 +545,8 @@ Strong enemy (GameObject)
 """
 class Warrior(Scout):
     #Warrior monster GameObject
+    __slots__ = ()
+    
     def __init__(self, dungeon, x, y):
         # bt_ai = BasicMonster(dungeon, fov_algo=constants.FOV_ALGO_BAD, 
             # vision_range=constants.FOV_RADIUS_BAD, flee_health = 0.1, flee_chance = 0.4)
@@ -502,6 +574,8 @@ Bard enemy
 """
 class Bard(Scout):
     #ranged monster GameObject
+    __slots__ = ()
+    
     def __init__(self, dungeon, x, y):
         
         bard_ai = BardNPC()
@@ -535,10 +609,9 @@ class Bard(Scout):
         if self.drop_objects:
             for itm in self.drop_objects:
                 # give it this position
-                itm.x = self.x
-                itm.y = self.y
+                itm.move_to(self.x, self.y)
                 # add to dungeon
-                _dungeon.objects.append(itm)
+                _dungeon.add_object(itm)
             # announce
             names = format_list([itm.name for itm in self.drop_objects])
             # add article for single items
@@ -556,8 +629,8 @@ class Bard(Scout):
         self.fighter = None
         self.ai = None
         
-        # sort this tile properly
-        _dungeon.game.sort_obj_at(self.x, self.y)
+        # now a corpse: sort this tile properly
+        _dungeon.sort_tile(self.x, self.y)
         
         # now re-count enemies (since we've set our Fighter to None)
         _dungeon.count_enemies()
@@ -567,6 +640,8 @@ Beowulf Boss game object!
 """
 class Beowulf(Scout):
     #Boss monster GameObject
+    __slots__ = ()
+    
     def __init__(self, dungeon, x, y):
         bt_ai = Beowulf_NPC(dungeon)
         
@@ -610,14 +685,19 @@ class Beowulf(Scout):
         self.fighter = None
         self.ai = None
         
-        # sort this tile properly
-        _dungeon.game.sort_obj_at(self.x, self.y)
+        # now a corpse: sort this tile properly
+        _dungeon.sort_tile(self.x, self.y)
         
 
 """
 Contains attack stats and attack names for a Fighter
 """
 class Weapon(Item):
+    __slots__ = ('min_dmg', 'max_dmg', 'speed', 'attack_names', 'attack_verbs', 'fighter',
+                 'map_char', 'map_color')
+    
+    type = 'weapon'
+    
     def __init__(self, min_dmg=1, max_dmg=6, speed=16, attack_names=['club','medium stick', 'bat'], attack_verbs=['bashes','bonks','hits'], map_char = 'w', map_color = colors.white):
         
         Item.__init__(self)
@@ -628,12 +708,26 @@ class Weapon(Item):
         self.attack_names = attack_names
         self.attack_verbs = attack_verbs
         
-        self.type = 'weapon'
-        
         self.fighter = None
         
-        self.owner = GameObject(_dungeon, -999, -999, map_char, self.name(), map_color, blocks=False, 
+        # how the weapon looks when it is on the map
+        self.map_char = map_char
+        self.map_color = map_color
+        
+    """
+    The GameObject carrying this weapon on the map, only made once something asks for it
+    (most weapons stay in a fighter's hands for their whole life)
+    """
+    @property
+    def owner(self):
+        if self._owner is None:
+            GameObject(_dungeon, -999, -999, self.map_char, self.name(), self.map_color, blocks=False, 
                  item=self)
+        return self._owner
+        
+    @owner.setter
+    def owner(self, value):
+        self._owner = value
         
     def roll_dmg(self, owner_ftr, target_ftr):
         return round(randint(self.min_dmg, self.max_dmg) + (owner_ftr.power/2) - target_ftr.defense)
@@ -693,10 +787,23 @@ class Dungeon:
         self.player = None
         self.objects = []
         self.map = None
+        # number of blocking objects on each tile, [x, y] like the map
+        self.occupancy = np.zeros((constants.MAP_WIDTH, constants.MAP_HEIGHT), dtype=np.uint8)
+        # {(x, y): [objects on that tile]} for every object in self.objects
+        self.tile_objects = {}
+        # 1 where a monster could step (open terrain, nothing blocking), kept up to date by occupy/unoccupy.
+        # move_astar's pathfinder reads it in place, so it is filled, never replaced
+        self.walkable = np.zeros((constants.MAP_WIDTH, constants.MAP_HEIGHT), dtype=np.int8)
+        self.astar = tcod.path.AStar(self.walkable, 1.0)
+        # monster fields of view, shared by all monsters
+        self.fov_cache = FovCache()
         self.inventory = []
         self.visible_tiles = []
         self.level = 1
         
+        # prepares the next floor in the background
+        self.floors = floors.FloorBuilder()
+        
         self.combatants = []
         self.visible_enemies = []
 
@@ -755,7 +862,7 @@ class Dungeon:
         self.player = Player(self, 0, 0)
         
         # add to objects list
-        self.objects.append(self.player)
+        self.add_object(self.player)
         
         # give the player some items
         # self.inventory.append(Muscle().item)
@@ -765,204 +872,216 @@ class Dungeon:
         # self.inventory.append(Muscle().item)
         # self.inventory.append(Legs().item)
         
-    def create_Beowulf(self):
-    
-        room = [room for room in self.generator.room_list if room.rtype is AreaTypes.BOSS][0]
-        pt = (1, 0)
-        tries = 0
-        added = False
-        x, y = room.center()
-        while not(added):
-            added = not(self.is_blocked(x, y))
-            if not(added):
-                if tries % 8 == 0:
-                    pt = (1,0)
-                    if randint(0,1) == 0:
-                        x += 1
-                    else:
-                        y += 1
-                pt = rotate_pt(pt, True)
-                x += pt[0]
-                y += pt[1]
-            tries += 1
+    def create_Beowulf(self, x, y):
         # place beowulf!
         boss = Beowulf(self, x, y)
         
         # add to dungeon!
-        _dungeon.objects.append(boss)
+        self.add_object(boss)
+        return boss
+        
+    ### OBJECTS ON THE MAP ###
+    def add_object(self, obj):
+        self.objects.append(obj)
+        obj.on_map = True
+        self.place(obj)
+            
+    def remove_object(self, obj):
+        self.objects.remove(obj)
+        self.unplace(obj)
+        obj.on_map = False
+        
+    """
+    Index obj at its current position (GameObject.move_to calls this and unplace).
+    Each tile's list is its draw order, obj goes on top of everything in its layer
+    """
+    def place(self, obj):
+        stack = self.tile_objects.setdefault((obj.x, obj.y), [])
+        layer = draw_layer(obj)
+        i = len(stack)
+        while i > 0 and draw_layer(stack[i-1]) > layer:
+            i -= 1
+        stack.insert(i, obj)
+        if obj.blocks:
+            self.occupy(obj)
+            
+    def unplace(self, obj):
+        here = self.tile_objects[(obj.x, obj.y)]
+        here.remove(obj)
+        if not here:
+            del self.tile_objects[(obj.x, obj.y)]
+        if obj.blocks:
+            self.unoccupy(obj)
+        
+    def occupy(self, obj):
+        if self.map_contains(obj.x, obj.y):
+            self.occupancy[obj.x, obj.y] += 1
+            self.walkable[obj.x, obj.y] = 0
+            
+    def unoccupy(self, obj):
+        if self.map_contains(obj.x, obj.y):
+            self.occupancy[obj.x, obj.y] -= 1
+            if self.map is not None and not self.occupancy[obj.x, obj.y]:
+                self.walkable[obj.x, obj.y] = not self.map.blocked[obj.x, obj.y]
+            
+    """
+    Recompute the whole walkability map from the terrain and occupancy (new map or objects)
+    """
+    def rebuild_walkable(self):
+        self.walkable[:] = ~self.map.blocked & (self.occupancy == 0)
+            
+    def map_contains(self, x, y):
+        return 0 <= x < constants.MAP_WIDTH and 0 <= y < constants.MAP_HEIGHT
+        
+    """
+    All objects on tile x, y, bottom to top (don't modify the list)
+    """
+    def objects_at(self, x, y):
+        return self.tile_objects.get((x, y), ())
+        
+    """
+    Re-sort a tile's stack after something on it changed layer (e.g. a fighter became a corpse)
+    """
+    def sort_tile(self, x, y):
+        stack = self.tile_objects.get((x, y))
+        if stack:
+            stack.sort(key=draw_layer)
+        
+    """
+    Rebuild the tile index and occupancy grid from self.objects (after replacing the list, e.g. loading a game)
+    """
+    def reindex_objects(self):
+        self.occupancy[:] = 0
+        self.tile_objects = {}
+        for obj in self.objects:
+            obj.on_map = True
+            self.place(obj)
+        if self.map is not None:
+            self.rebuild_walkable()
         
     def count_enemies(self):
         fighters = [obj.fighter for obj in self.objects if obj.fighter]
         self.enemies_left = len(fighters) - 1 # subtract player
         
     ### MAP CREATION ###
-    def make_map(self):
+    def make_map(self, seed=None):
+        
+        # generate layout
+        generator = make_generator(seed=seed, **default_generator_args())
+        
+        if seed is not None:
+            # a chosen seed always gives the same layout, reuse it from disk when possible
+            LevelCache().gen_valid_level(generator)
+        else:
+            # take a pre-generated level if one is ready, otherwise generate it here
+            level = None
+            if self.game.level_supply:
+                level = self.game.level_supply.get()
+            if level is not None:
+                generator.import_level(level)
+            else:
+                generator.gen_valid_level()
+        
+        # the first floor is populated from the global RNG, as it always was
+        self.build_floor(floors.plan_floor(generator, self.level, self.last_floor()))
+        self.prepare_next_floor()
+        
+    def last_floor(self):
+        return self.level >= constants.FLOOR_COUNT
+        
+    """
+    Start making the floor below this one in the background (nothing below the last floor)
+    """
+    def prepare_next_floor(self):
+        if self.last_floor():
+            return
+        floor = self.level + 1
+        self.floors.request(floor, floors.floor_seed(floor), floor >= constants.FLOOR_COUNT)
+        
+    """
+    Stairs object at x, y if there is one
+    """
+    def stairs_at(self, x, y):
+        for obj in self.objects_at(x, y):
+            if isinstance(obj, Stairs):
+                return obj
+        return None
+        
+    """
+    Move the player down to the next floor, return False if there is no floor below
+    """
+    def descend(self):
+        if self.last_floor():
+            return False
+        
+        self.level += 1
+        plan = self.floors.take(self.level)
+        if plan is None:
+            # not prepared (or failed): make it now
+            plan = floors.make_floor(self.level, floors.floor_seed(self.level), self.last_floor())
+        
+        # leave everything but the player behind
+        for obj in self.objects:
+            if obj is not self.player:
+                obj.on_map = False
+        self.objects = [self.player]
+        self.reindex_objects()
+        self.schedule = {}
+        self.visible_tiles = []
+        self.visible_enemies = []
+        self.combatants = []
+        
+        self.build_floor(plan)
+        self.prepare_next_floor()
+        return True
+        
+    """
+    Stop preparing floors (call when this dungeon is thrown away)
+    """
+    def close(self):
+        self.floors.shutdown()
+        logging.info('Monster FOV: %s', self.fov_cache)
+        
+    """
+    Create the tiles and objects of a floor from its FloorPlan
+    """
+    def build_floor(self, plan):
     
         if self.map:
             del self.map
             
         if self.generator:
             del self.generator
+        self.generator = plan.generator
      
-        #fill map with "blocked" wall tiles
-        self.map = [[Tile(True)
-            for y in range(constants.MAP_HEIGHT)]
-                for x in range(constants.MAP_WIDTH)]
-                
-        rooms = []
-        num_rooms = 0
-        
-        monsters_left = constants.MONSTER_COUNT
-        
-        # generate layout
-        self.generator = Generator(width=constants.MAP_WIDTH, height=constants.MAP_HEIGHT,
-                max_rooms=constants.MAX_ROOMS, min_room_xy=constants.ROOM_MIN_SIZE,
-                max_room_xy=constants.ROOM_MAX_SIZE)
-        
-        valid = False
-        while not valid:
-            valid = self.generator.gen_level()
-        
-        # populate tiles
-        for row_num, row in enumerate(self.generator.level):
-            for col_num, col in enumerate(row):
-                    t = self.map[col_num][row_num]
-                    t.blocked = col.blocked
-                    t.block_sight = t.blocked
-                    t.color_light = col.color_light
-                    t.color_dark = col.color_dark
+        # tiles straight from the generator grid, anything it doesn't cover stays blocked
+        self.map = TileMap.from_grid(self.generator.grid, constants.MAP_WIDTH, constants.MAP_HEIGHT)
+        self.fov_cache.clear()
+        self.rebuild_walkable()
                     
-        # find room marked player room
-        p_room = [room for room in self.generator.room_list if room.rtype is AreaTypes.PLAYER][0]
-        # only add player to this room
-        pt = (1, 0)
-        tries = 0
-        added_player = False
-        px, py = p_room.center()
-        while not(added_player):
-            added_player = not(self.is_blocked(px, py))
-            if not(added_player):
-                if tries % 8 == 0:
-                    pt = (1,0)
-                    if randint(0,1) == 0:
-                        px += 1
-                    else:
-                        py += 1
-                pt = rotate_pt(pt, True)
-                px += pt[0]
-                py += pt[1]
-            tries += 1
         # assign player room coordinates
-        self.player.x, self.player.y = px, py
-        
-        # place beowulf in a big room
-        self.create_Beowulf()
-        
-        # add items to rooms
-        while monsters_left > 0:
-            for i, new_room in enumerate(self.generator.room_list):
-                if not(new_room is p_room):
-                    # qty of monsters can depend on room size
-                    #max_monsters = round((new_room[2] * new_room[3])/3.0)
-                    max_monsters = 1
-                    monsters = randint(0, min(monsters_left, max_monsters))
-                    monsters_left -= monsters
-                    
-                    # add them!
-                    self.place_objects_gen(new_room, monsters)
-                
-        # add items to monsters
-        self.add_items_to_monsters(constants.ITEM_QTY)
-        
-        # print layout of dungeon
-        self.generator.gen_tiles_level()
-        
-    def add_items_to_monsters(self, num_items):
-        monsters = [obj for obj in self.objects if obj.fighter and obj != self.player]
-        max_items = num_items
-        # give it an item to drop on death if there are items left
-        #HEAL_MOD = 4 # every 4th item or so guaranteed to be heart
-        monster = choice(monsters)
-        while num_items > 0:
-            monster = choice(monsters)
-            add_items = True
-            itm = None
-            while add_items:
-                if not(itm):
-                    # choose random item
-                    itm = self.choose_item()
-                # add item to monster
-                if len(monster.drop_objects) > 0:
-                    names = [itm.name for itm in monster.drop_objects]
-                    tries = 0
-                    while itm.name in names and tries < 20:
-                        del itm
-                        itm = self.choose_item()
-                    if itm.name in names:
-                        del itm
-                if itm:
-                    num_items -= 1
-                    monster.drop_objects.append(itm)
-                    add_items = randint(0,100) < 5
-                else:
-                    add_items = False
-            
+        self.player.move_to(*plan.player)
+        
+        fighters = []
+        # place beowulf in a big room on the last floor, stairs down there on the others
+        if plan.boss:
+            fighters.append(self.create_Beowulf(*plan.boss))
+        if plan.stairs:
+            self.add_object(Stairs(self, *plan.stairs))
+            
+        # add monsters to rooms
+        kinds = {floors.SCOUT: Scout, floors.WARRIOR: Warrior, floors.BARD: Bard}
+        for kind, x, y in plan.monsters:
+            monster = kinds[kind](self, x, y)
+            self.add_object(monster)
+            fighters.append(monster)
             
-
-    def choose_item(self):
-        return self.gen_items[randint(0,4)](-1,-1)
-                
+        # add items to monsters
+        for idx, items in plan.drops.items():
+            for i in items:
+                fighters[idx].drop_objects.append(self.gen_items[i](-1,-1))
                 
-    def place_objects_gen(self, room, num_monsters):   
-        # don't place monster in room with player, prefer rooms with 'obstacles'
-        if room.rtype == AreaTypes.PLAYER or not(room.obstacles or randint(0,2) == 2):
-            return
-    
-        # room = (x, y, w, h)
-        tries = 0
-        mon_left = num_monsters
-        for i in range(num_monsters):
-            added = False
-            while not(added) and tries < 100:
-                tries += 1
-            
-                #choose random spot for this monster
-                x = randint(room.x - room.w + 1, room.x + room.w - 1)
-                y = randint(room.y - room.h + 1, room.y + room.h - 1)
-         
-                #only place it if the tile is not blocked
-                if not self.is_blocked(x, y):
-                
-                    self.enemies_left += 1
-                    mon_left -= 1
-                    added = True
-                    montype = randfloat(0, 1)
-                    if montype < constants.MONSTER_SPECIAL:
-                        montype = randfloat(0, 1)
-                        if montype < constants.MONSTER_BARD:
-                            # bard
-                            monster = Bard(self, x, y)
-                            # add monster to dungeon
-                            self.objects.append(monster)
-                            mon_left -= 1
-                            added = False
-                            break
-                        montype = randfloat(0,1)
-                        if montype < constants.MONSTER_TOUGH:
-                            #create a tough guy
-                            monster = Warrior(self, x, y)
-                            # add monster to dungeon
-                            self.objects.append(monster)
-                            mon_left -= 1
-                            added = False
-                            break
-                    else:
-                        #create a scout regardless
-                        monster = Scout(self, x, y)                                                
-                        # add monster to dungeon
-                        self.objects.append(monster)
-                    
-    
+        self.count_enemies()
                 
     ### MAP QUERIES ###
     def distance_to(self, game_obj, other_game_obj):
@@ -981,32 +1100,18 @@ class Dungeon:
     def distance2(self, x1, y1, x2, y2):
         return ((x2 - x1) ** 2) + ((y2 - y1) ** 2)
 
-    def is_visible_tile(self, x, y):
-     
-        if x >= constants.MAP_WIDTH or x < 0:
-            return False
-        elif y >= constants.MAP_HEIGHT or y < 0:
-            return False
-        elif self.map[x][y].blocked == True:
-            return False
-        elif self.map[x][y].block_sight == True:
-            return False
-        else:
-            return True
-
+    """
+    Tiles a monster at x, y can see, reused while neither the spot nor the terrain changes
+    """
+    def monster_view(self, x, y, radius):
+        return self.fov_cache.get(x, y, radius, self.map.version, compute_monster_view)
+        
     def is_blocked(self, x, y):
         if x >= constants.MAP_WIDTH or y >= constants.MAP_HEIGHT or x < 0 or y < 0:
             return True
     
-        #first test the map tile
-        if self.map[x][y].blocked:
-            return True
-     
-        #now check for any blocking self.objects
-        for obj in self.objects:
-            if obj.blocks and obj.x == x and obj.y == y:
-                return True
-        return False
+        #the map tile, then any blocking objects standing on it
+        return bool(self.map.blocked[x, y] or self.occupancy[x, y])
         
     def closest_monster(self, from_gameobj, max_range):
         #find closest enemy, up to a maximum range, and in the player's FOV
@@ -1026,10 +1131,7 @@ class Dungeon:
     def move(self, game_obj, dx, dy):
         #move by the given amount, if the destination is not blocked
         if not self.is_blocked(game_obj.x + dx, game_obj.y + dy):
-            game_obj.x += dx
-            game_obj.y += dy
-            # send items here to back
-            _dungeon.game.sort_obj_at(game_obj.x, game_obj.y)
+            game_obj.move_to(game_obj.x + dx, game_obj.y + dy)
             return True
         return False
  
@@ -1060,43 +1162,30 @@ class Dungeon:
         
         
     def move_astar(self, game_obj, x, y, max_pathsize=999):
-        #Create a FOV map that has the dimensions of the map
-        fov = tcod.map_new(constants.MAP_WIDTH, constants.MAP_HEIGHT)
- 
-        #Scan the current map each turn and set all the walls as unwalkable
-        for y1 in range(constants.MAP_HEIGHT):
-            for x1 in range(constants.MAP_WIDTH):
-                tcod.map_set_properties(fov, x1, y1, not self.map[x1][y1].block_sight, not self.map[x1][y1].blocked)
-                
- 
-        #Scan all the objects to see if there are objects that must be navigated around
-        #Check also that the object isn't game_obj or the target (so that the start and the end points are free)
-        #The AI class handles the situation if self is next to the target so it will not use this A* function anyway   
-        for obj in self.objects:
-            if obj.blocks and obj != game_obj and (obj.x != x or obj.y != y):
-                #Set the tile as a wall so it must be navigated around
-                tcod.map_set_properties(fov, obj.x, obj.y, True, False)
- 
-        #Allocate a A* path
-        my_path = tcod.path_new_using_map(fov, 1.0)
+        #The start and goal tiles are free for this search even if game_obj or the target stands on them
+        #The AI class handles the situation if self is next to the target so it will not use this A* function anyway
+        ends = [(game_obj.x, game_obj.y), (x, y)]
+        saved = [self.walkable[end] for end in ends]
+        for end in ends:
+            self.walkable[end] = not self.map.blocked[end]
         
         #Compute the path between self's coordinates and the target's coordinates
-        tcod.path_compute(my_path, game_obj.x, game_obj.y, x, y)
+        path = self.astar.get_path(game_obj.x, game_obj.y, x, y)
+        
+        for end, walkable in zip(ends, saved):
+            self.walkable[end] = walkable
         
         logging.debug('%s moves a-star: start from %s,%s', game_obj.name, game_obj.x, game_obj.y)
         
         moved = False
  
-        #Check if the path exists     
-        if not(tcod.path_is_empty(my_path)):
-            #Find the next coordinates in the computed full path
-            x, y = tcod.path_walk(my_path, True)
-            if not (x is None or y is None) and not self.is_blocked(x, y):
+        #Check if the path exists, then take its first step
+        if path and len(path) <= max_pathsize:
+            step_x, step_y = path[0]
+            if not self.is_blocked(step_x, step_y):
                 #Set game_obj's coordinates to the next path tile
-                game_obj.x = x
-                game_obj.y = y
-                self.game.sort_obj_at(x,y)
-                logging.debug('A-star move to %s,%s', x, y)
+                game_obj.move_to(step_x, step_y)
+                logging.debug('A-star move to %s,%s', step_x, step_y)
                 moved = True
        
         #Keep the old move function as a backup so that if there are no paths (for example another monster blocks a corridor)
@@ -1104,9 +1193,6 @@ class Dungeon:
         if not(moved):
             self.move_towards(game_obj, x, y) 
             logging.debug('Simple move towards %s,%s', x, y)
- 
-        #Delete the path to free memory
-        tcod.path_delete(my_path)
         
     
     ### FIGHTER ACTIONS ###
@@ -1118,8 +1204,8 @@ class Dungeon:
      
         #try to find an attackable object there
         target = None
-        for obj in self.objects:
-            if obj.fighter and obj.x == x and obj.y == y:
+        for obj in self.objects_at(x, y):
+            if obj.fighter:
                 target = obj
                 break
         
@@ -1156,18 +1242,12 @@ class Dungeon:
         # day, month, year (year is offset from 1970 in order to use normal date-time structs)
         self.date_string = time.strftime("%d %b", stime) + ', ' + str(int(stime[0] - constants.TIME_SUBTRACT_YEARS)) + ' AD'
         self.time_string = time.strftime("%I:%M:%S %p", stime)
- 
-    def send_to_back(self, game_obj):
-        #make this object be drawn first, so all others appear above it if 
-        #they're in the same tile.
-        self.objects.remove(game_obj)
-        self.objects.insert(0, game_obj)
     
     def pick_up(self, items):
         #add to the player's inventory and remove from the map
         for item in items:
             self.inventory.append(item.item)
-            self.objects.remove(item)
+            self.remove_object(item)
         
         #msg
         text = format_list([item.name for item in items])
@@ -1203,6 +1283,10 @@ class Dungeon:
 Monster AI
 """
 class NPC:
+    __slots__ = ('owner', 'fov_radius', 'flee_health', 'flee_chance', 'state', 'last_state', 'state_turns',
+                 'pdistance', 'last_attack_turn', 'view', 'last_px', 'last_py', 'target_x', 'target_y',
+                 'hearing', 'laziness', 'curses', 'cursed')
+    
     def __init__(self, hearing = 0.05, laziness = 0.2, 
             vision_range = constants.START_VISION, flee_health=0.4, flee_chance=0.75, 
             curses=['Kill the beast!', 'Destroy the monster!', 'Die, creature!']):
@@ -1287,7 +1371,7 @@ class NPC:
         # if monster sees player... 
         elif self.pdistance < constants.MAX_HEAR_DIST:
             # fov (store visible tiles)
-            self.view = tdl.map.quickFOV(monster.x, monster.y, is_visible_tile, radius = self.fov_radius)
+            self.view = _dungeon.monster_view(monster.x, monster.y, self.fov_radius)
             # if player could be seen...
             if self.player_in_view():
                 # strong chance to wake from sleep
@@ -1665,6 +1749,8 @@ class NPC:
 Bard AI
 """
 class BardNPC(NPC):
+        __slots__ = ('music_range', 'music_power', 'music_speed', 'flee_dist')
+        
         def __init__(self, hearing = 0.1, laziness = 0.2, 
                 vision_range = 5, flee_health=0.8, flee_chance=0.95, 
                 curses=['It hates the music!']):
@@ -1742,7 +1828,7 @@ class BardNPC(NPC):
                 # if monster sees player... 
                 elif self.pdistance < constants.MAX_HEAR_DIST:
                     # fov (store visible tiles)
-                    self.view = tdl.map.quickFOV(monster.x, monster.y, is_visible_tile, radius = self.fov_radius)
+                    self.view = _dungeon.monster_view(monster.x, monster.y, self.fov_radius)
                     # if player could be seen...
                     viewed = self.player_in_view()
                     if viewed:
@@ -1837,6 +1923,8 @@ Beowulf with special move
 """
 class Beowulf_NPC(NPC):
     #AI for boss monster
+    __slots__ = ('leader', 'special')
+    
     def __init__(self, dungeon, fov_algo = constants.FOV_ALGO, vision_range = constants.START_VISION+1, 
         flee_health=0, flee_chance=0, curses=['Tonight you die by my hand, monster!']):
         
@@ -1914,19 +2002,11 @@ class Beowulf_NPC(NPC):
         
 
 ### functions with  no class ###
-### callback functions ###
-def is_visible_tile(x, y):
-
-    if x >= constants.MAP_WIDTH or x < 0:
-        return False
-    elif y >= constants.MAP_HEIGHT or y < 0:
-        return False
-    elif _dungeon.map[x][y].blocked == True:
-        return False
-    elif _dungeon.map[x][y].block_sight == True:
-        return False
-    else:
-        return True
+"""
+Field of view of a monster (filled into Dungeon.fov_cache)
+"""
+def compute_monster_view(x, y, radius):
+    return fov.FieldOfView(_dungeon.map, x, y, radius, algorithm=constants.FOV_MONSTER)
         
 
 
@@ -2060,6 +2140,16 @@ def cast_heal():
     
     return True
     
+"""
+Draw order of objects sharing a tile: fighters above items above everything else (corpses, stairs)
+"""
+def draw_layer(obj):
+    if obj.fighter:
+        return 2
+    if obj.item:
+        return 1
+    return 0
+    
 """
 Randomly rotate a point (x,y) within a set of clockface 'positions'
 """
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for the dungeon generator, built on the same loop as dungeon_generator.try_break_map.
+Runs a number of seeded generations and writes machine readable JSON results, e.g.
+
+    python dungeon_benchmark.py -n 500 -s 0 -o bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dungeon_generator import Generator
+from dungeon_generator import FAIL_ERROR
+from dungeon_generator import FAIL_CONNECTIVITY
+
+from level_supply import default_generator_args
+
+"""
+Current git commit of the working tree this script is in, if there is one
+"""
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def percentiles_ms(seconds):
+    if not seconds:
+        return None
+    p50, p95, p99 = np.percentile(np.array(seconds) * 1000.0, [50, 95, 99])
+    return {'p50': round(p50, 3), 'p95': round(p95, 3), 'p99': round(p99, 3),
+            'mean': round(float(np.mean(seconds)) * 1000.0, 3), 'max': round(max(seconds) * 1000.0, 3)}
+
+"""
+Generate count valid levels from seeds seed, seed+1, ... and return a dict of results:
+levels per second, latency percentiles for valid levels and single attempts,
+retry rate, failure counts by reason and how many failures were repaired in place (plus gen_level phase timings if profile is set).
+With workers > 0 the regions of each level are filled by that many worker processes
+"""
+def run_benchmark(count=200, seed=0, generator_args=None, max_tries=100, profile=False, workers=0):
+    args = generator_args or default_generator_args()
+    pool = ProcessPoolExecutor(workers) if workers > 0 else None
+    gen = Generator(profile=profile, pool=pool, **args)
+
+    level_times = []
+    attempt_times = []
+    failures = Counter()
+    attempts = 0
+    repaired = 0
+    gave_up = 0
+
+    start = time.perf_counter()
+    # generator reports failures on stdout, keep them out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(count):
+            gen.reseed(seed + i)
+            level_start = time.perf_counter()
+            valid = False
+            tries = 0
+            while not valid and tries < max_tries:
+                tries += 1
+                attempt_start = time.perf_counter()
+                try:
+                    valid = gen.gen_level()
+                    reason = gen.failure
+                    # same fallback as Generator.gen_valid_level
+                    if not valid and reason == FAIL_CONNECTIVITY and gen.repair_level():
+                        valid = True
+                        repaired += 1
+                except Exception:
+                    valid = False
+                    reason = FAIL_ERROR
+                attempt_times.append(time.perf_counter() - attempt_start)
+                if reason is not None:
+                    failures[reason] += 1
+            attempts += tries
+            if valid:
+                level_times.append(time.perf_counter() - level_start)
+            else:
+                gave_up += 1
+    elapsed = time.perf_counter() - start
+    if pool:
+        pool.shutdown()
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'count': count,
+        'seed': seed,
+        'generator': dict(args),
+        'workers': workers,
+        'elapsed_s': round(elapsed, 4),
+        'levels_per_sec': round(len(level_times) / elapsed, 3) if elapsed > 0 else None,
+        'level_latency_ms': percentiles_ms(level_times),
+        'attempt_latency_ms': percentiles_ms(attempt_times),
+        'attempts': attempts,
+        'retry_rate': round((attempts - count) / attempts, 5) if attempts else 0.0,
+        'failures': dict(failures),
+        'repaired': repaired,
+        'gave_up': gave_up,
+    }
+    if gen.stats:
+        results['phases'] = gen.stats.report()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the dungeon generator.')
+    parser.add_argument('-n', '--count', type=int, default=200, help='number of levels to generate')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='first seed (levels use seed, seed+1, ...)')
+    parser.add_argument('-o', '--output', default=None, help='write JSON results to this file (default: stdout)')
+    parser.add_argument('-p', '--profile', action='store_true', help='include per-phase gen_level timings')
+    parser.add_argument('--width', type=int, default=None)
+    parser.add_argument('--height', type=int, default=None)
+    parser.add_argument('--max-rooms', type=int, default=None)
+    parser.add_argument('--regions', type=int, default=None, help='regions per side of the map (default 2)')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='worker processes filling regions (default: none)')
+    opts = parser.parse_args(argv)
+
+    args = default_generator_args()
+    if opts.width:
+        args['width'] = opts.width
+    if opts.height:
+        args['height'] = opts.height
+    if opts.max_rooms:
+        args['max_rooms'] = opts.max_rooms
+    if opts.regions:
+        args['region_grid'] = opts.regions
+
+    results = run_benchmark(opts.count, opts.seed, args, profile=opts.profile, workers=opts.workers)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    sys.exit(main())
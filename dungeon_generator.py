@@ -14,11 +14,15 @@
 from __future__ import print_function
 import random
 
+import time
+
 from enum import Enum
 
-import constants
+import numpy as np
 
-import tcod
+import constants
+import gridutil
+import prefabs
 
 import colors
 
@@ -34,6 +38,15 @@ light_boss_wall = (62,48,65)
 dark_boss_floor = (0,31,32)
 dark_boss_wall =  (24,19,26)
 
+# bump whenever a change alters the levels produced for a given seed
+GENERATOR_VERSION = 5
+
+# reasons for Generator.test_level to reject a level
+FAIL_DIMENSIONS = 'dimensions'
+FAIL_ROOM_COUNT = 'room_count'
+FAIL_CONNECTIVITY = 'connectivity'
+FAIL_ERROR = 'error'
+
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -51,13 +64,69 @@ class TileTypes(Enum):
         self.char = char
         self.color_light = color_light
         self.color_dark = color_dark
+        
+    # code of this tile type in a Generator's numpy level grid
+    @property
+    def code(self):
+        return TILE_CODES[self]
     
+# numpy level grids store each tile as its index in TILE_TYPES
+TILE_TYPES = list(TileTypes)
+TILE_CODES = {t: i for i, t in enumerate(TILE_TYPES)}
+
+STONE = TILE_CODES[TileTypes.STONE]
+FLOOR = TILE_CODES[TileTypes.FLOOR]
+BOSS_FLOOR = TILE_CODES[TileTypes.BOSS_FLOOR]
+WALL = TILE_CODES[TileTypes.WALL]
+BOSS_WALL = TILE_CODES[TileTypes.BOSS_WALL]
+OBSTACLE = TILE_CODES[TileTypes.OBSTACLE]
+
+# lookup tables indexed by tile code
+TILE_BLOCKED = np.array([t.blocked for t in TILE_TYPES], dtype=bool)
+TILE_CHARS = np.array([t.char for t in TILE_TYPES])
+TILE_LIGHT = np.array([t.color_light for t in TILE_TYPES], dtype=np.uint8)
+TILE_DARK = np.array([t.color_dark for t in TILE_TYPES], dtype=np.uint8)
+
+# tile codes for the characters used in prefab templates
+PREFAB_CODES = {'.': FLOOR, '#': WALL, 'o': OBSTACLE}
+
+"""
+A room template from prefabs.TEMPLATES compiled to tile code arrays, ready to be stamped
+"""
+class Prefab:
+    def __init__(self, name, kind, rows):
+        self.name = name
+        self.kind = kind
+        self.tiles = np.array([[PREFAB_CODES[c] for c in row] for row in rows], dtype=np.uint8)
+        self.h, self.w = self.tiles.shape
+        
+        # boss room version
+        self.boss_tiles = self.tiles.copy()
+        self.boss_tiles[self.tiles == FLOOR] = BOSS_FLOOR
+        self.boss_tiles[self.tiles == WALL] = BOSS_WALL
+        
+        walkable = ~TILE_BLOCKED[self.tiles]
+        if not (walkable[0].all() and walkable[-1].all() and walkable[:, 0].all() and walkable[:, -1].all()):
+            raise ValueError('Prefab edges must be floor!', name)
+        if gridutil.label_regions(walkable)[1] != 1:
+            raise ValueError('Prefab floor must be connected!', name)
+            
+    def tiles_for(self, atype):
+        return self.boss_tiles if atype is AreaTypes.BOSS else self.tiles
+        
+    def __repr__(self):
+        return '<Prefab {0} ({1}) {2}x{3}>'.format(self.name, self.kind, self.w, self.h)
 
 # types of 'special rooms'
 class AreaTypes(Enum):
     PLAYER = 1
     BOSS = 2
     NORMAL = 3
+    
+# compiled prefabs by kind
+PREFABS = {}
+for name, (kind, rows) in prefabs.TEMPLATES.items():
+    PREFABS.setdefault(kind, []).append(Prefab(name, kind, rows))
                    
 class Obstacle:
     def __init__(self, x, y, width, height, area_type):
@@ -73,7 +142,7 @@ class Obstacle:
                    
                    
 class Room:
-    def __init__(self, x, y, width, height, atype=AreaTypes.NORMAL, obstacles=False):
+    def __init__(self, x, y, width, height, atype=AreaTypes.NORMAL, obstacles=False, rng=random):
         self.x = x
         self.y = y
         self.w = width
@@ -99,14 +168,17 @@ class Room:
             ph = (self.h // 2) - 1
             for i in range(amount):
                 x, y = self.center()
-                x += random.randint(-pw, pw)
-                y += random.randint(-ph, ph)
+                x += rng.randint(-pw, pw)
+                y += rng.randint(-ph, ph)
                 # new obstacle
                 self.obstacles.append(Obstacle(x,y,1,1,atype))
         
         # room type
         self.rtype = atype
         
+        # Prefab stamped in place of a plain rectangle, if any
+        self.prefab = None
+        
     def center(self):
         return ( (self.x + (self.w//2), self.y + (self.h//2)) )
         
@@ -131,95 +203,231 @@ class Corridor:
         return len(self.points)
     
  
+"""
+Optional per-phase timers and counters for Generator.gen_level. The last run's values are in
+last_times / last_counts, totals over all runs since the last reset in total_times / total_counts
+"""
+class GenStats:
+    def __init__(self):
+        self.reset()
+        
+    def reset(self):
+        self.runs = 0
+        self.last_times = {}
+        self.last_counts = {}
+        self.total_times = {}
+        self.total_counts = {}
+        self.mark = time.perf_counter()
+        
+    """
+    Start timing a new gen_level run
+    """
+    def begin_run(self):
+        self.runs += 1
+        self.last_times = {}
+        self.last_counts = {}
+        self.mark = time.perf_counter()
+        
+    """
+    Charge the time since the previous lap (or begin_run) to phase
+    """
+    def lap(self, phase):
+        now = time.perf_counter()
+        spent = now - self.mark
+        self.mark = now
+        self.last_times[phase] = self.last_times.get(phase, 0.0) + spent
+        self.total_times[phase] = self.total_times.get(phase, 0.0) + spent
+        
+    def count(self, name, amount=1):
+        self.last_counts[name] = self.last_counts.get(name, 0) + amount
+        self.total_counts[name] = self.total_counts.get(name, 0) + amount
+        
+    """
+    Aggregate over all runs: mean ms and share of total time per phase, totals and means per counter
+    """
+    def report(self):
+        runs = max(self.runs, 1)
+        total = sum(self.total_times.values()) or 1.0
+        phases = {}
+        for phase, spent in self.total_times.items():
+            phases[phase] = {'mean_ms': round(spent * 1000.0 / runs, 4), 'share': round(spent / total, 4)}
+        counts = {}
+        for name, amount in self.total_counts.items():
+            counts[name] = {'total': amount, 'mean': round(amount / runs, 3)}
+        return {'runs': self.runs, 'phases': phases, 'counts': counts}
+        
+    def __repr__(self):
+        phases = sorted(self.total_times.items(), key=lambda p: -p[1])
+        runs = max(self.runs, 1)
+        return 'Runs: {0}, '.format(self.runs) + ', '.join(
+            '{0}: {1:.3f}ms'.format(phase, spent * 1000.0 / runs) for phase, spent in phases)
+        
+ 
 class Generator():
     def __init__(self, width=64, height=64, max_rooms=15, min_room_xy=5,
-                 max_room_xy=10):
+                 max_room_xy=10, seed=None, profile=False, region_grid=2, pool=None,
+                 prefab_chance=constants.PREFAB_CHANCE):
         self.width = width
         self.height = height
         
+        # chance for a room to be a prefab instead of a plain rectangle
+        self.prefab_chance = prefab_chance
+        
+        # the map is split into region_grid x region_grid regions, filled independently
+        # (in parallel when pool is a concurrent.futures executor)
+        self.region_grid = region_grid
+        self.pool = pool
+        
+        # private random number generator, seeded for reproducible levels
+        self.seed = seed
+        self.rng = random.Random(seed)
+        
+        # per-phase timing of gen_level (None unless profiling)
+        self.stats = None
+        if profile:
+            self.stats = GenStats()
+        
         self.max_rooms = max_rooms
         self.min_room_xy = min_room_xy
         self.max_room_xy = max_room_xy
         
         self.init_lists()
         
+    """
+    Restart the random number generator from seed (the same seed gives the same levels)
+    """
+    def reseed(self, seed):
+        self.seed = seed
+        self.rng.seed(seed)
+        
+    """
+    Everything besides the seed that decides which levels this generator produces
+    """
+    def params(self):
+        return (GENERATOR_VERSION, self.width, self.height, self.max_rooms,
+                self.min_room_xy, self.max_room_xy, self.region_grid, self.prefab_chance)
+        
     def init_lists(self):
-        self.level = []
+        self.grid = np.full((self.height, self.width), STONE, dtype=np.uint8)
         self.room_list = []
+        # tiles covered by placed rooms, used to reject overlapping rooms
+        self.room_grid = np.zeros((self.height, self.width), dtype=bool)
         self.corridor_list = []
         self.tiles_level = []
         self.regions = []
         
+        # rooms found unreachable by the last test_level
+        self.unreachable = []
+        # why the last test_level failed (one of the FAIL_ values), None if it passed
+        self.failure = None
+        
     def clear_lists(self):
-        del self.level
+        del self.grid
         del self.room_list
+        del self.room_grid
         del self.corridor_list
         del self.tiles_level
         del self.regions
+        del self.unreachable
+        del self.failure
         
     def gen_room_in_region(self, region_x, region_y, region_w, region_h, atype=AreaTypes.NORMAL):
+        if self.prefab_chance and self.rng.random() < self.prefab_chance:
+            room = self.gen_prefab_in_region(region_x, region_y, region_w, region_h, atype, prefabs.ROOM)
+            if room:
+                return room
+                
         x, y, w, h = 0, 0, 0, 0
  
-        w = random.randint(self.min_room_xy, self.max_room_xy)
-        h = random.randint(self.min_room_xy, self.max_room_xy)
+        w = self.rng.randint(self.min_room_xy, self.max_room_xy)
+        h = self.rng.randint(self.min_room_xy, self.max_room_xy)
         
         minx = region_x+1
         miny = region_y+1
         
-        x = random.randint(minx, (region_x + region_w - w - 4))
-        y = random.randint(miny, (region_y + region_h - h - 4))
+        x = self.rng.randint(minx, (region_x + region_w - w - 4))
+        y = self.rng.randint(miny, (region_y + region_h - h - 4))
  
         #create a room
         if atype != AreaTypes.NORMAL:
             obs = True
         else:
-            obs = random.randint(1,3) < 3
-        return Room(x, y, w, h, atype, obs)
+            obs = self.rng.randint(1,3) < 3
+        return Room(x, y, w, h, atype, obs, self.rng)
         
     def gen_large_room_in_region(self, region_x, region_y, region_w, region_h, atype=AreaTypes.BOSS):
+        if self.prefab_chance and self.rng.random() < self.prefab_chance:
+            room = self.gen_prefab_in_region(region_x, region_y, region_w, region_h, atype, prefabs.ARENA)
+            if room:
+                return room
+                
         x, y, w, h = 0, 0, 0, 0
  
         newmin = min(constants.BIGROOM_MIN_W, max(region_w-6, 1))
         newmax = min(constants.BIGROOM_MAX_W, max(region_w-4, 2))
-        w = random.randint(newmin, newmax)
+        w = self.rng.randint(newmin, newmax)
         
         newmin = min(constants.BIGROOM_MIN_H,  max(region_h-6, 1))
         newmax = min(constants.BIGROOM_MAX_H, max(region_h-4, 2))
-        h = random.randint(newmin, newmax)
+        h = self.rng.randint(newmin, newmax)
         
         minx = region_x+1
         miny = region_y+1
         
-        x = random.randint(minx, max((minx + region_w - w - 4),minx+1))
-        y = random.randint(miny, max((miny + region_h - h - 4),miny+1))
+        x = self.rng.randint(minx, max((minx + region_w - w - 4),minx+1))
+        y = self.rng.randint(miny, max((miny + region_h - h - 4),miny+1))
  
         #create a room
-        return Room(x, y, w, h, atype, True)
+        return Room(x, y, w, h, atype, True, self.rng)
  
-    def room_overlapping(self, room, room_list):
+    """
+    Room stamped from a random prefab of the given kind, placed like gen_room_in_region.
+    None if the chosen prefab doesn't fit in the region
+    """
+    def gen_prefab_in_region(self, region_x, region_y, region_w, region_h, atype, kind):
+        prefab = self.rng.choice(PREFABS[kind])
+        
+        minx = region_x+1
+        miny = region_y+1
+        maxx = region_x + region_w - prefab.w - 4
+        maxy = region_y + region_h - prefab.h - 4
+        if maxx < minx or maxy < miny:
+            return None
+            
+        room = Room(self.rng.randint(minx, maxx), self.rng.randint(miny, maxy), prefab.w, prefab.h, atype)
+        room.prefab = prefab
+        if self.stats:
+            self.stats.count('prefabs')
+        return room
+ 
+    """
+    True if room is out of bounds or overlaps any placed room (checks the room placement grid)
+    """
+    def room_overlapping(self, room):
         x = room.x
         y = room.y
         w = room.w
         h = room.h
         
+        if self.stats:
+            self.stats.count('placement_attempts')
+        
         # out of bounds
         if x + w  > self.width or y + h > self.height or x < 0 or y < 0:
-            return True
- 
-        for current_room in room_list:
- 
-            # The rectangles don't overlap if
-            # one rectangle's minimum in some dimension
-            # is greater than the other's maximum in
-            # that dimension.
- 
-            if (x < (current_room.x + current_room.w) and
-                current_room.x < (x + w) and
-                y < (current_room.y + current_room.h) and
-                current_room.y < (y + h)):
- 
-                return True
-        return False
+            overlapping = True
+        else:
+            overlapping = self.room_grid[y:y + h, x:x + w].any()
+        
+        if overlapping and self.stats:
+            self.stats.count('rejected_overlaps')
+        return overlapping
+        
+    """
+    Add room to room_list and mark its tiles as taken in the room placement grid
+    """
+    def add_room(self, room):
+        self.room_list.append(room)
+        self.room_grid[room.y:room.y + room.h, room.x:room.x + room.w] = True
  
  
     def corridor_between_points(self, x1, y1, x2, y2, join_type='either', atype=AreaTypes.NORMAL):
@@ -241,7 +449,7 @@ class Generator():
  
                 join = 'top'
             elif join_type is 'either':
-                join = random.choice(['top', 'bottom'])
+                join = self.rng.choice(['top', 'bottom'])
             else:
                 join = join_type
  
@@ -271,7 +479,7 @@ class Generator():
  
         # overlapping on x
         if x1 < (x2 + w2) and x2 < (x1 + w1):
-            jx1 = random.randint(x2, x1_2)
+            jx1 = self.rng.randint(x2, x1_2)
             jx2 = jx1
             tmp_y = [y1, y2, y1_2, y2_2]
             tmp_y.sort()
@@ -284,10 +492,10 @@ class Generator():
         # overlapping on y
         elif y1 < (y2 + h2) and y2 < (y1 + h1):
             if y2 > y1:
-                jy1 = random.randint(y2, y1_2)
+                jy1 = self.rng.randint(y2, y1_2)
                 jy2 = jy1
             else:
-                jy1 = random.randint(y1, y2_2)
+                jy1 = self.rng.randint(y1, y2_2)
                 jy2 = jy1
             tmp_x = [x1, x2, x1_2, x2_2]
             tmp_x.sort()
@@ -301,387 +509,527 @@ class Generator():
         else:
             join = None
             if join_type is 'either':
-                join = random.choice(['top', 'bottom'])
+                join = self.rng.choice(['top', 'bottom'])
             else:
                 join = join_type
  
             if join is 'top':
                 if y2 > y1:
                     jx1 = x1_2 + 1
-                    jy1 = random.randint(y1, y1_2)
-                    jx2 = random.randint(x2, x2_2)
+                    jy1 = self.rng.randint(y1, y1_2)
+                    jx2 = self.rng.randint(x2, x2_2)
                     jy2 = y2 - 1
                     corridors = self.corridor_between_points(
                         jx1, jy1, jx2, jy2, 'bottom', atype)
                     self.corridor_list.append(corridors)
                 else:
-                    jx1 = random.randint(x1, x1_2)
+                    jx1 = self.rng.randint(x1, x1_2)
                     jy1 = y1 - 1
                     jx2 = x2 - 1
-                    jy2 = random.randint(y2, y2_2)
+                    jy2 = self.rng.randint(y2, y2_2)
                     corridors = self.corridor_between_points(
                         jx1, jy1, jx2, jy2, 'top', atype)
                     self.corridor_list.append(corridors)
  
             elif join is 'bottom':
                 if y2 > y1:
-                    jx1 = random.randint(x1, x1_2)
+                    jx1 = self.rng.randint(x1, x1_2)
                     jy1 = y1_2 + 1
                     jx2 = x2 - 1
-                    jy2 = random.randint(y2, y2_2)
+                    jy2 = self.rng.randint(y2, y2_2)
                     corridors = self.corridor_between_points(
                         jx1, jy1, jx2, jy2, 'top', atype)
                     self.corridor_list.append(corridors)
                 else:
                     jx1 = x1_2 + 1
-                    jy1 = random.randint(y1, y1_2)
-                    jx2 = random.randint(x2, x2_2)
+                    jy1 = self.rng.randint(y1, y1_2)
+                    jx2 = self.rng.randint(x2, x2_2)
                     jy2 = y2_2 + 1
                     corridors = self.corridor_between_points(
                         jx1, jy1, jx2, jy2, 'bottom', atype)
                     self.corridor_list.append(corridors)
 
     def gen_level(self):
+        stats = self.stats
+        if stats:
+            stats.begin_run()
     
         # clear out any previous generation
         self.clear_lists()
         self.init_lists()
  
-        # build an empty dungeon, blank the room and corridor lists
-        for i in range(self.height):
-            self.level.append([TileTypes.STONE] * self.width)
-        #self.level = [[TileTypes.STONE for y in range(self.height)] for x in range(self.width)]
-        
-        # divide the dungeon up into 4 'regions' to generate rooms inside of
-        w = int(self.width * 0.45)
-        h = int(self.height * 0.45)
-        x1 = 0
-        x2 = self.width - w - 1
-        y1 = 0
-        y2 = self.height - h - 1
-        
-        # set the 'regions' used
-        r1 = (x1, y1, w, h)
-        r2 = (x2, y1, w, h)
-        r3 = (x2, y2, w, h)
-        r4 = (x1, y2, w, h)
-        self.regions.extend([r1, r2, r3, r4])
+        # divide the dungeon up into 'regions' to generate rooms inside of, visited in a
+        # snake through the rows of the region grid
+        n = self.region_grid
+        w = int(self.width * 0.9 / n)
+        h = int(self.height * 0.9 / n)
+        xs = [round(i * (self.width - w - 1) / max(n - 1, 1)) for i in range(n)]
+        ys = [round(i * (self.height - h - 1) / max(n - 1, 1)) for i in range(n)]
+        for row, y in enumerate(ys):
+            for x in (xs if row % 2 == 0 else reversed(xs)):
+                self.regions.append((x, y, w, h))
         proom_idx = 0
         # determine whether to reverse dungeon layout randomly...
-        rev = random.randint(0,1) == 0
+        rev = self.rng.randint(0,1) == 0
         if rev:
             self.regions.reverse()
             proom_idx = 3
             
- 
-        # FIRST REGIONS
-        rindex = -1
-        # start generating rooms in the first 'normal' regions
-        max_region_rooms = self.max_rooms // 4
+        # fill every region on its own, from its own seed; the last one holds the boss rooms
+        max_region_rooms = self.max_rooms // len(self.regions)
         max_iters = max_region_rooms * 4
         last = len(self.regions)-1
-        for i, r in enumerate(self.regions):
-            rr = 0
-            tries = 0
+        size = (self.width, self.height, self.min_room_xy, self.max_room_xy, self.prefab_chance)
+        tasks = [(self.rng.getrandbits(32), size, r, max_region_rooms, max_iters, i, i == last,
+                  stats is not None) for i, r in enumerate(self.regions)]
+        if self.pool:
+            results = list(self.pool.map(gen_region, tasks))
+        else:
+            results = [gen_region(task) for task in tasks]
+            
+        if stats:
+            stats.lap('regions')
+            # the regions' own counters (placement attempts, overlaps, prefabs)
+            for rooms, corridors, counts in results:
+                for name, amount in counts.items():
+                    stats.count(name, amount)
+            
+        # stitch the regions together, in order
+        region_rooms = []
+        for i, (rooms, corridors, counts) in enumerate(results):
+            for room in rooms:
+                self.add_room(room)
+            self.corridor_list.extend(corridors)
+            
+            prev_rooms = region_rooms[-1] if region_rooms else []
+            region_rooms.append(rooms)
+            if not (rooms and prev_rooms):
+                continue
+            
             if i < last:
-                while rr < max_region_rooms and tries < max_iters:
-                    tries += 1
-                    
-                    # generate the rooms
-                    tmp_room = self.gen_room_in_region(r[0], r[1], r[2], r[3])
-                        
-                    tmp_room_list = self.room_list[:]
-     
-                    if not(self.room_overlapping(tmp_room, tmp_room_list)):
-                        self.room_list.append(tmp_room)
-                        rr += 1
-         
-                    if rr >= max_region_rooms:
-                        break
-                        
-                # connect the rooms in this region
-                for a in range(rindex+1, len(self.room_list)-1):
-                    self.join_rooms(self.room_list[a], self.room_list[a + 1])
-                    
-                # do a number of random room joins in this region
-                joins = random.randint(3,4+i)
-                for i in range(joins):
-                    r1 = self.room_list[random.randint(rindex+1, len(self.room_list)-1)]
-                    r2 = self.room_list[random.randint(rindex+1, len(self.room_list)-1)]
-                    while r1 is r2:
-                        r2 = self.room_list[random.randint(rindex+1, len(self.room_list)-1)]
+                # connect a few rooms at the end of the previous region to this one
+                for a in range(min(self.rng.randint(2,3), len(prev_rooms))):
+                    r1 = prev_rooms[-1 - a]
+                    r2 = rooms[self.rng.randint(0, len(rooms)-1)]
                     self.join_rooms(r1, r2)
-                
-                # connect to previous region
-                if i > 0:
-                    for i in range(random.randint(2,3)):
-                        r1 = self.room_list[rindex-i]
-                        r2 = self.room_list[random.randint(rindex+1, len(self.room_list)-1)]
-                        self.join_rooms(r1, r2)
-                # last room in this region, for next iteration
-                rindex = len(self.room_list)-1
+            else:
+                # make one connection to the boss region
+                r1 = prev_rooms[-1]
+                r2 = rooms[self.rng.randint(0, len(rooms)-1)]
+                self.join_rooms(r1, r2, atype = AreaTypes.BOSS)
  
         # mark first room as 'player start'
-        self.room_list[proom_idx].rtype = AreaTypes.PLAYER
-        
-        # LAST REGION
-        r = self.regions[last]
-        # and now several large rooms
-        target = len(self.room_list) + 3
-        fits = False
-        tmp_room_list = self.room_list[:]
-        for a in range(max_iters):
-            # generate the large rooms
-            tmp_room = self.gen_large_room_in_region(r[0], r[1], r[2], r[3], atype=AreaTypes.BOSS)
-            fits = not(self.room_overlapping(tmp_room, tmp_room_list))
-            if fits:
-                self.room_list.append(tmp_room)
-                if len(self.room_list) >= target:
-                    break;
-        # fill in last region with several small rooms
-        target = len(self.room_list) + 5
-        fits = False
-        tmp_room_list = self.room_list[:]
-        for a in range(max_iters):
-            # generate the small rooms
-            tmp_room = self.gen_room_in_region(r[0], r[1], r[2], r[3], atype=AreaTypes.BOSS)
-            fits = not(self.room_overlapping(tmp_room, tmp_room_list))
-            if fits:
-                self.room_list.append(tmp_room)
-                if len(self.room_list) >= target:
-                    break;
-            
-        # connect the rooms in the new region
-        max_index = len(self.room_list)-1
-        if max_index >= rindex + 2:
-            for i in range(rindex+1, max_index):
-                self.join_rooms(self.room_list[i], self.room_list[i+1], atype = AreaTypes.BOSS)
-        
-        # make one connection to a previous region
-        r1 = self.room_list[rindex]
-        r2 = self.room_list[random.randint(rindex+1, len(self.room_list)-1)]
-        self.join_rooms(r1, r2, atype = AreaTypes.BOSS)
+        first_rooms = region_rooms[0]
+        if first_rooms:
+            first_rooms[min(proom_idx, len(first_rooms)-1)].rtype = AreaTypes.PLAYER
+        
+        if stats:
+            stats.lap('stitch')
  
         # fill the map
-        
-        # paint rooms
+        self.paint_rooms()
+        if stats:
+            stats.lap('paint_rooms')
+        self.paint_corridors()
+        if stats:
+            stats.lap('paint_corridors')
+        self.paint_walls()
+        self.paint_obstacles()
+        if stats:
+            stats.lap('paint_obstacles')
+            
+        valid = self.test_level()
+        if stats:
+            stats.lap('test_level')
+            stats.count('rooms', len(self.room_list))
+            if not valid:
+                stats.count('failed_' + str(self.failure))
+        return valid
+    
+    
+    """
+    Paint room floors into the level grid
+    """
+    def paint_rooms(self):
         for room in self.room_list:
-            for b in range(room.w):
-                for c in range(room.h):
-                    ttype = TileTypes.FLOOR
-                    if room.rtype is AreaTypes.BOSS:
-                        ttype = TileTypes.BOSS_FLOOR
-                    self.level[room.y + c][room.x + b] = ttype
-        
-        # paint corridors
-        for corridor in self.corridor_list:
-            x1, y1 = corridor[0]
-            x2, y2 = corridor[1]
+            area = (slice(room.y, room.y + room.h), slice(room.x, room.x + room.w))
+            if room.prefab:
+                self.grid[area] = room.prefab.tiles_for(room.rtype)
+                continue
+                
+            ttype = FLOOR
+            if room.rtype is AreaTypes.BOSS:
+                ttype = BOSS_FLOOR
+            self.grid[area] = ttype
             
-            ttype = TileTypes.FLOOR
+    """
+    Paint corridor floors into the level grid, one slice per straight segment
+    """
+    def paint_corridors(self):
+        for corridor in self.corridor_list:
+            ttype = FLOOR
             if corridor.atype is AreaTypes.BOSS:
-                ttype = TileTypes.BOSS_FLOOR
+                ttype = BOSS_FLOOR
             
-            for width in range(abs(x1 - x2) + 1):
-                for height in range(abs(y1 - y2) + 1):
-                    self.level[min(y1, y2) + height][
-                        min(x1, x2) + width] = ttype
-                        
-            if len(corridor) == 3:
-                x3, y3 = corridor[2]    
-                for width in range(abs(x2 - x3) + 1):
-                    for height in range(abs(y2 - y3) + 1):
-                        self.level[min(y2, y3) + height][
-                            min(x2, x3) + width] = ttype
- 
-        # paint the walls
-        normals = [TileTypes.STONE, TileTypes.WALL]
-        # paint boss areas
-        for row in range(0, self.height - 1):
-            for col in range(0, self.width - 1):
-                if self.level[row][col] is TileTypes.BOSS_FLOOR:
-                    if self.level[row - 1][col - 1] in normals:
-                        self.level[row - 1][col - 1] = TileTypes.BOSS_WALL
- 
-                    if self.level[row - 1][col] in normals:
-                        self.level[row - 1][col] = TileTypes.BOSS_WALL
- 
-                    if self.level[row - 1][col + 1] in normals:
-                        self.level[row - 1][col + 1] = TileTypes.BOSS_WALL
- 
-                    if self.level[row][col - 1] in normals:
-                        self.level[row][col - 1] = TileTypes.BOSS_WALL
- 
-                    if self.level[row][col + 1] in normals:
-                        self.level[row][col + 1] = TileTypes.BOSS_WALL
- 
-                    if self.level[row + 1][col - 1] in normals:
-                        self.level[row + 1][col - 1] = TileTypes.BOSS_WALL
- 
-                    if self.level[row + 1][col] in normals:
-                        self.level[row + 1][col] = TileTypes.BOSS_WALL
- 
-                    if self.level[row + 1][col + 1] in normals:
-                        self.level[row + 1][col + 1] = TileTypes.BOSS_WALL
-                        
-        #paint 'normal' areas
-        for row in range(0, self.height - 1):
-            for col in range(0, self.width - 1):
-                if self.level[row][col] is TileTypes.FLOOR:
-                    if self.level[row - 1][col - 1] is TileTypes.STONE:
-                        self.level[row - 1][col - 1] = TileTypes.WALL
- 
-                    if self.level[row - 1][col] is TileTypes.STONE:
-                        self.level[row - 1][col] = TileTypes.WALL
- 
-                    if self.level[row - 1][col + 1] is TileTypes.STONE:
-                        self.level[row - 1][col + 1] = TileTypes.WALL
- 
-                    if self.level[row][col - 1] is TileTypes.STONE:
-                        self.level[row][col - 1] = TileTypes.WALL
- 
-                    if self.level[row][col + 1] is TileTypes.STONE:
-                        self.level[row][col + 1] = TileTypes.WALL
- 
-                    if self.level[row + 1][col - 1] is TileTypes.STONE:
-                        self.level[row + 1][col - 1] = TileTypes.WALL
- 
-                    if self.level[row + 1][col] is TileTypes.STONE:
-                        self.level[row + 1][col] = TileTypes.WALL
- 
-                    if self.level[row + 1][col + 1] is TileTypes.STONE:
-                        self.level[row + 1][col + 1] = TileTypes.WALL
-                        
-        # paint 'obstacles' in rooms
-        for room in self.room_list:
-            for o in room.obstacles:
-                for y in range(o.h):
-                    for x in range(o.w):
-                        oy = o.y+y
-                        ox = o.x+x
-                        clear = True
-                        # check for adjacent walls...
-                        for w in range(-1,2):
-                            for h in range(-1,2):
-                                # skip obstacles that are next to walls
-                                if self.level[oy+h][ox+w] == TileTypes.WALL or self.level[oy+h][ox+w] == TileTypes.BOSS_WALL:
-                                    clear = False
-                                    break
-                        if clear:
-                            self.level[oy][ox] = o.tile_type
-        
-        return self.test_level()
+            for (x1, y1), (x2, y2) in zip(corridor.points, corridor.points[1:]):
+                self.grid[min(y1, y2):max(y1, y2) + 1,
+                          min(x1, x2):max(x1, x2) + 1] = ttype
+                          
+        if self.stats:
+            self.stats.count('corridors_painted', len(self.corridor_list))
+                          
+    """
+    Surround floors with walls: stone next to boss floor becomes BOSS_WALL first,
+    then any remaining stone next to normal floor becomes WALL
+    """
+    def paint_walls(self):
+        stone = self.grid == STONE
+        self.grid[stone & gridutil.dilate(self.grid == BOSS_FLOOR)] = BOSS_WALL
+        if self.stats:
+            self.stats.lap('paint_boss_walls')
+        
+        stone = self.grid == STONE
+        self.grid[stone & gridutil.dilate(self.grid == FLOOR)] = WALL
+        if self.stats:
+            self.stats.lap('paint_walls')
+        
+    """
+    Paint room obstacles, skipping any that would be next to a wall
+    """
+    def paint_obstacles(self):
+        cells = [(o.y + y, o.x + x) for room in self.room_list for o in room.obstacles
+                    for y in range(o.h) for x in range(o.w)]
+        if not cells:
+            return
+        ys, xs = np.array(cells).T
+        wanted = np.zeros(self.grid.shape, dtype=bool)
+        wanted[ys, xs] = True
+        
+        walls = (self.grid == WALL) | (self.grid == BOSS_WALL)
+        near_walls = wanted & gridutil.dilate(walls)
+        wanted &= ~near_walls
+        
+        # place obstacles a third of the tiles at a time: tiles in the same pass are 3 apart,
+        # so blocking one never changes whether another in the pass is an articulation point
+        painted = 0
+        for oy in range(3):
+            for ox in range(3):
+                batch = np.zeros_like(wanted)
+                batch[oy::3, ox::3] = wanted[oy::3, ox::3]
+                if not batch.any():
+                    continue
+                batch &= gridutil.removable(~TILE_BLOCKED[self.grid])
+                self.grid[batch] = OBSTACLE
+                painted += int(batch.sum())
+        
+        if self.stats:
+            self.stats.count('obstacles_painted', painted)
+            self.stats.count('obstacles_skipped', int(near_walls.sum()))
+            self.stats.count('obstacles_cut_points', int(wanted.sum()) - painted)
+        
+    """
+    TileTypes view of the level grid (rows of columns), kept for older callers
+    """
+    @property
+    def level(self):
+        return [[TILE_TYPES[c] for c in row] for row in self.grid.tolist()]
+    
+    
+    """
+    Generate levels until one passes test_level, return the number of tries used
+    (gives up and returns None after max_tries failures if max_tries is set)
+    """
+    def gen_valid_level(self, max_tries=None):
+        tries = 0
+        while max_tries is None or tries < max_tries:
+            tries += 1
+            # connectivity failures are usually a room or two cut off, cheaper to fix than to redo
+            if self.gen_level() or self.repair_level():
+                return tries
+        return None
+        
+    """
+    Try to fix a level that failed test_level only because some rooms are unreachable:
+    join each cut off room to the nearest reachable room with a new corridor. Returns True if
+    every room is reachable afterwards
+    """
+    def repair_level(self):
+        if self.failure != FAIL_CONNECTIVITY:
+            return False
+            
+        p_room = [room for room in self.room_list if room.rtype is AreaTypes.PLAYER][0]
+        connected = self.connect_rooms(p_room)
+        if self.stats:
+            self.stats.lap('repair')
+        if not connected:
+            return False
+        self.failure = None
+        return True
+        
+    """
+    Join every room that can't be reached from start (by default, from the largest walkable
+    area) to the nearest reachable room with a new corridor, carve it, and merge the areas it
+    touches. Leaves the rooms still cut off in self.unreachable, returns True if there are none
+    """
+    def connect_rooms(self, start=None):
+        labels, count = gridutil.label_regions(~TILE_BLOCKED[self.grid])
+        if count == 0:
+            self.unreachable = list(self.room_list)
+            return not self.unreachable
+        
+        # areas joined by new corridors are merged with a small union-find over the labels
+        parent = list(range(count + 1))
+        def find(label):
+            while parent[label] != label:
+                parent[label] = parent[parent[label]]
+                label = parent[label]
+            return label
+            
+        if start is not None:
+            s_labels = labels[start.y:start.y + start.h, start.x:start.x + start.w]
+            s_counts = np.bincount(s_labels.ravel(), minlength=2)[1:]
+            if not s_counts.any():
+                self.unreachable = [room for room in self.room_list if room is not start]
+                return False
+        else:
+            s_counts = np.bincount(labels.ravel(), minlength=2)[1:]
+        main = s_counts.argmax() + 1
+        
+        def room_labels(room):
+            area = labels[room.y:room.y + room.h, room.x:room.x + room.w]
+            return set(area[area > 0].tolist())
+            
+        def reachable(room):
+            return any(find(l) == find(main) for l in room_labels(room))
+        
+        for room in [room for room in self.room_list if not reachable(room)]:
+            if reachable(room):
+                # already connected by an earlier repair
+                continue
+                
+            cx, cy = room.center()
+            targets = [r for r in self.room_list if r is not room and reachable(r)]
+            if not targets:
+                break
+            target = min(targets, key=lambda r: (r.center()[0] - cx) ** 2 + (r.center()[1] - cy) ** 2)
+            
+            first = len(self.corridor_list)
+            self.join_rooms(room, target, atype=room.rtype if room.rtype is AreaTypes.BOSS else AreaTypes.NORMAL)
+            new_corridors = self.corridor_list[first:]
+            
+            # merge every area the new corridors touch
+            carved = self.carve_corridors(new_corridors)
+            touched = labels[gridutil.dilate(carved)]
+            touched = set(touched[touched > 0].tolist()) | room_labels(room)
+            roots = {find(label) for label in touched}
+            merged = find(main) if find(main) in roots else min(roots)
+            for root in roots:
+                parent[root] = merged
+                
+            if self.stats:
+                self.stats.count('repair_corridors', len(new_corridors))
+            
+        self.unreachable = [room for room in self.room_list if not reachable(room)]
+        return not self.unreachable
+        
+    """
+    Paint corridors added after the level was filled, with walls around them.
+    Returns a mask of the tiles they cover
+    """
+    def carve_corridors(self, corridors):
+        carved = np.zeros(self.grid.shape, dtype=bool)
+        boss = np.zeros(self.grid.shape, dtype=bool)
+        for corridor in corridors:
+            for (x1, y1), (x2, y2) in zip(corridor.points, corridor.points[1:]):
+                area = (slice(min(y1, y2), max(y1, y2) + 1), slice(min(x1, x2), max(x1, x2) + 1))
+                carved[area] = True
+                if corridor.atype is AreaTypes.BOSS:
+                    boss[area] = True
+                    
+        self.grid[carved & ~boss] = FLOOR
+        self.grid[boss] = BOSS_FLOOR
+        
+        stone = self.grid == STONE
+        around = gridutil.dilate(carved) & stone
+        self.grid[around & gridutil.dilate(boss)] = BOSS_WALL
+        self.grid[around & ~gridutil.dilate(boss)] = WALL
+        return carved
+        
+    """
+    Return the finished level as a dict of compact numpy arrays (grid, rooms,
+    obstacles, corridors, regions) that can be pickled or written to disk
+    """
+    def export_level(self):
+        rooms = [(r.x, r.y, r.w, r.h, r.rtype.value) for r in self.room_list]
+        obstacles = [(i, o.x, o.y, o.w, o.h) for i, r in enumerate(self.room_list) for o in r.obstacles]
+        corridors = []
+        for c in self.corridor_list:
+            points = [p for pt in c.points for p in pt]
+            points += [0] * (6 - len(points))
+            corridors.append([c.atype.value, len(c)] + points)
+        
+        return {
+            'grid': self.grid.copy(),
+            'rooms': np.array(rooms, dtype=np.int16).reshape(-1, 5),
+            'obstacles': np.array(obstacles, dtype=np.int16).reshape(-1, 5),
+            'corridors': np.array(corridors, dtype=np.int16).reshape(-1, 8),
+            'regions': np.array(self.regions, dtype=np.int16).reshape(-1, 4),
+        }
+        
+    """
+    Replace the current level with one produced by export_level
+    """
+    def import_level(self, data):
+        grid = np.array(data['grid'], dtype=np.uint8)
+        
+        self.clear_lists()
+        self.height, self.width = grid.shape
+        self.init_lists()
+        self.grid = grid
+        
+        for x, y, w, h, rtype in data['rooms'].tolist():
+            self.add_room(Room(x, y, w, h, AreaTypes(rtype)))
+        for i, x, y, w, h in data['obstacles'].tolist():
+            room = self.room_list[i]
+            room.obstacles.append(Obstacle(x, y, w, h, room.rtype))
+        for row in data['corridors'].tolist():
+            atype, count = row[0], row[1]
+            points = [(row[2 + 2*i], row[3 + 2*i]) for i in range(count)]
+            self.corridor_list.append(Corridor(points, AreaTypes(atype)))
+        self.regions = [tuple(r) for r in data['regions'].tolist()]
     
     
     """
-    Pathfinding check - return True if valid map and False if not
+    Validity check - return True if valid map and False if not
     """
     def test_level(self):
     
         success = False
+        self.failure = FAIL_ERROR
         try:
-            if len(self.level) != self.height:
-                print('Invalid level height! Actual = {0}, Requested = {1}'.format(len(self.level), self.height))
+            if self.grid.shape[0] != self.height:
+                print('Invalid level height! Actual = {0}, Requested = {1}'.format(self.grid.shape[0], self.height))
+                self.failure = FAIL_DIMENSIONS
                 return False
             
-            for r in self.level:
-                if len(r) != self.width:
-                    print('Invalid level width! Actual = {0}, Requested = {1}'.format(len(r), self.width))
-                    return False
+            if self.grid.shape[1] != self.width:
+                print('Invalid level width! Actual = {0}, Requested = {1}'.format(self.grid.shape[1], self.width))
+                self.failure = FAIL_DIMENSIONS
+                return False
                     
             # guarantee a minimum number of rooms
             if len(self.room_list) < (constants.MAX_ROOMS // 2):
-                print('Invalid room count! Actual = %i, Requested = %i'.format(len(r), self.width))
+                print('Invalid room count! Actual = {0}, Requested = {1}'.format(len(self.room_list), constants.MAX_ROOMS // 2))
+                self.failure = FAIL_ROOM_COUNT
                 return False
             
-            # now pathfind to sanity check!
-            p_room = [room for room in self.room_list if room.rtype is AreaTypes.PLAYER][0]
-            b_room = [room for room in self.room_list if room.rtype is AreaTypes.BOSS][0]
-            success = self.test_pathfind(p_room, b_room)
+            if not any(room.rtype is AreaTypes.BOSS for room in self.room_list):
+                print('No boss room!')
+                self.failure = FAIL_ROOM_COUNT
+                return False
+            
+            # now check that every room can be reached from the player room
+            self.unreachable = self.unreachable_rooms()
+            if self.unreachable:
+                print('Unreachable rooms! {0}'.format(self.unreachable))
+                self.failure = FAIL_CONNECTIVITY
+                return False
+            success = True
+            self.failure = None
         finally:
             return success
         
+    """
+    Label the connected walkable areas of the level and return the list of rooms
+    that can't be reached from the player room
+    """
+    def unreachable_rooms(self):
+        labels, count = gridutil.label_regions(~TILE_BLOCKED[self.grid])
         
-    def test_pathfind(self, room_start, room_end):
-        #Create a FOV map that has the dimensions of the map
-        fov = tcod.map_new(self.width, self.height)
- 
-        #Scan the current map and set all the walls as unwalkable
-        for y1 in range(self.height):
-            for x1 in range(self.width):
-                open = not (self.level[y1][x1].blocked)
-                tcod.map_set_properties(fov, x1, y1, open, open)
-                
-        #Allocate a A* path
-        my_path = tcod.path_new_using_map(fov, 1.0)
-
-        # find at least one empty tile in room_start
-        blocked = True
-        while blocked:
-            for x in range(room_start.w):
-                x1 = room_start.x + x
-                for y in range(room_start.h):
-                    y1 = room_start.y + y
-                    blocked = self.level[y1][x1].blocked
-                    if not blocked:
-                        break
-                if not blocked:
-                    break
-                    
-        # find at least one empty tile in room_end
-        blocked = True
-        while blocked:
-            for x in range(room_end.w):
-                x2 = room_end.x + x
-                for y in range(room_end.h):
-                    y2 = room_end.y + y
-                    blocked = self.level[y2][x2].blocked
-                    if not blocked:
-                        break
-                if not blocked:
-                    break
-        
-        # use our two empty tiles to path
-        tcod.path_compute(my_path, x1, y1, x2, y2)
- 
-        #Walk the path
-        success = False
-        if my_path and not tcod.path_is_empty(my_path):
-            success = True
-            while not tcod.path_is_empty(my_path):
-                x, y = tcod.path_walk(my_path,True)
-                if x is None :
-                    print('Pathfinding failed during walk!')
-                    success = False
-                    break
-        else:
-            print('Pathfinding failed to create a path!')
-        
-        #Delete the path to free memory
-        tcod.path_delete(my_path)
+        # the player room's area is the most common label among its tiles
+        p_room = [room for room in self.room_list if room.rtype is AreaTypes.PLAYER][0]
+        p_labels = labels[p_room.y:p_room.y + p_room.h, p_room.x:p_room.x + p_room.w]
+        p_counts = np.bincount(p_labels.ravel(), minlength=2)[1:]
         
-        return success
+        reachable = np.zeros(count + 1, dtype=bool)
+        if p_counts.any():
+            reachable[p_counts.argmax() + 1] = True
+        return [room for room in self.room_list
+                    if not reachable[labels[room.y:room.y + room.h, room.x:room.x + room.w]].any()]
  
     """
     Print tile chars of map
     """
     def gen_tiles_level(self):
  
-        for row_num, row in enumerate(self.level):
-            tmp_tiles = []
- 
-            for col_num, col in enumerate(row):
-                tmp_tiles.append(col.char)
- 
-            self.tiles_level.append(''.join(tmp_tiles))
+        for row in TILE_CHARS[self.grid]:
+            self.tiles_level.append(''.join(row))
  
         [print(row) for row in self.tiles_level]
         
     def __repr__(self):
         return 'Rooms: {0}, Corridors: {1}, Dimensions: {2}x{3}, Regions: {4}'.format(
-            len(self.room_list), len(self.corridor_list), len(self.level[0]), len(self.level), self.regions)
+            len(self.room_list), len(self.corridor_list), self.grid.shape[1], self.grid.shape[0], self.regions)
 
     
+"""
+Place and join the rooms of one region. Everything it needs is in 'task' and the result only
+depends on the task's seed, so regions can be filled in any order or in worker processes.
+Returns (rooms, corridors, counts), counts being the region's GenStats counters when profiling
+(empty otherwise) for the parent to add to its own
+"""
+def gen_region(task):
+    seed, size, region, max_rooms, max_iters, index, boss, profile = task
+    width, height, min_room_xy, max_room_xy, prefab_chance = size
+    gen = Generator(width, height, max_rooms, min_room_xy, max_room_xy, seed=seed, prefab_chance=prefab_chance,
+                    profile=profile)
+    rx, ry, rw, rh = region
+    
+    if not boss:
+        for a in range(max_iters):
+            tmp_room = gen.gen_room_in_region(rx, ry, rw, rh)
+            if not(gen.room_overlapping(tmp_room)):
+                gen.add_room(tmp_room)
+                if len(gen.room_list) >= max_rooms:
+                    break
+        
+        rooms = gen.room_list
+        if len(rooms) > 1:
+            # connect the rooms in this region
+            for a in range(len(rooms)-1):
+                gen.join_rooms(rooms[a], rooms[a+1])
+            # do a number of random room joins in this region
+            for a in range(gen.rng.randint(3,4+index)):
+                r1 = gen.rng.choice(rooms)
+                r2 = gen.rng.choice(rooms)
+                while r1 is r2:
+                    r2 = gen.rng.choice(rooms)
+                gen.join_rooms(r1, r2)
+    else:
+        # several large rooms
+        for a in range(max_iters):
+            tmp_room = gen.gen_large_room_in_region(rx, ry, rw, rh, atype=AreaTypes.BOSS)
+            if not(gen.room_overlapping(tmp_room)):
+                gen.add_room(tmp_room)
+                if len(gen.room_list) >= 3:
+                    break
+        # fill in the rest with several small rooms
+        target = len(gen.room_list) + 5
+        for a in range(max_iters):
+            tmp_room = gen.gen_room_in_region(rx, ry, rw, rh, atype=AreaTypes.BOSS)
+            if not(gen.room_overlapping(tmp_room)):
+                gen.add_room(tmp_room)
+                if len(gen.room_list) >= target:
+                    break
+        
+        # connect the rooms in the boss region
+        rooms = gen.room_list
+        for a in range(len(rooms)-1):
+            gen.join_rooms(rooms[a], rooms[a+1], atype = AreaTypes.BOSS)
+    
+    counts = gen.stats.last_counts if gen.stats else {}
+    return gen.room_list, gen.corridor_list, counts
+    
 def try_break_map(count):
     success = 0
     fail = 0
@@ -698,22 +1046,24 @@ def try_break_map(count):
         else:
             fail += 1
             gen.gen_tiles_level()
-            print('Failed!')
+            print('Failed! ({0})'.format(gen.failure))
             
         print('Fail: ' + str(fail) + ', Success: ' + str(success))
         print('')
         
 if __name__ == '__main__':
     import sys
+    from level_archive import LevelArchiveWriter
 
     gen = Generator(width=constants.MAP_WIDTH, height=constants.MAP_HEIGHT,
                 max_rooms=constants.MAX_ROOMS, min_room_xy=constants.ROOM_MIN_SIZE,
                 max_room_xy=constants.ROOM_MAX_SIZE)
     
-    sys.stdout = open('dungen_examples.log', 'w')
+    # python dungeon_generator.py [count] [archive path]
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    path = sys.argv[2] if len(sys.argv) > 2 else 'dungen_examples.lvl'
     
-    for i in range(100):
-        if not(gen.gen_level()):
-            print('Failure!!! See below:')
-        gen.gen_tiles_level()
-        print(gen)
+    with LevelArchiveWriter(path, GENERATOR_VERSION) as archive:
+        for i in range(count):
+            gen.reseed(i)
+            archive.add_generator(gen, gen.gen_level())
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import constants
+
+from dungeon_generator import AreaTypes
+from dungeon_generator import TILE_BLOCKED
+
+from level_supply import default_generator_args
+from level_supply import make_generator
+from level_cache import LevelCache
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# monster kinds in a FloorPlan, Dungeon.build_floor maps them to classes
+SCOUT = 'scout'
+WARRIOR = 'warrior'
+BARD = 'bard'
+
+# number of item kinds (Dungeon.gen_items) a monster can carry
+ITEM_KINDS = 5
+
+"""
+Everything needed to build one floor: its generated layout, where the player, Beowulf (last
+floor) or the stairs down (other floors) go, the monsters and the items each fighter drops.
+Plain data only, so it can be made away from the main thread
+"""
+class FloorPlan:
+    def __init__(self, floor, seed, generator):
+        self.floor = floor
+        self.seed = seed
+        self.generator = generator
+
+        self.player = None
+        self.boss = None
+        self.stairs = None
+        # [(kind, x, y), ...]
+        self.monsters = []
+        # {fighter index: [item kind, ...]} where fighters are the boss (if any) then the monsters
+        self.drops = {}
+
+    def __repr__(self):
+        return '<FloorPlan {0} seed:{1} monsters:{2} items:{3}>'.format(
+            self.floor, self.seed, len(self.monsters), sum(len(v) for v in self.drops.values()))
+
+"""
+Seed for a floor's layout and population. Drawn from the global RNG unless the game replays a
+fixed LEVEL_SEED (read at each call, so it can be set after import); call from the main thread only
+"""
+def floor_seed(floor, base_seed=None):
+    if base_seed is None:
+        base_seed = constants.LEVEL_SEED
+    if base_seed is None:
+        return random.getrandbits(32)
+    return random.Random(repr((base_seed, floor))).getrandbits(32)
+
+# clockface directions used to spiral out from a blocked tile
+_clockwise = [(1,0), (1,1), (0,1), (-1,1), (-1,0), (-1,-1), (0,-1), (1,-1)]
+
+"""
+Walk out from x, y until blocked(x, y) is False (same search the game always used)
+"""
+def _open_tile_near(x, y, blocked, rng):
+    pt = 0
+    tries = 0
+    while blocked(x, y):
+        if tries % 8 == 0:
+            pt = 0
+            if rng.randint(0,1) == 0:
+                x += 1
+            else:
+                y += 1
+        pt = (pt + 1) % len(_clockwise)
+        x += _clockwise[pt][0]
+        y += _clockwise[pt][1]
+        tries += 1
+    return (x, y)
+
+"""
+Decide where everything on a generated floor goes, using only rng for randomness
+"""
+def plan_floor(generator, floor, last, rng=random, seed=None):
+    plan = FloorPlan(floor, seed, generator)
+    grid = generator.grid
+    height, width = grid.shape
+    occupied = set()
+
+    def blocked(x, y):
+        if x < 0 or y < 0 or x >= width or y >= height:
+            return True
+        return TILE_BLOCKED[grid[y, x]] or (x, y) in occupied
+
+    # player in the player room, Beowulf or the stairs in the boss room
+    p_room = [room for room in generator.room_list if room.rtype is AreaTypes.PLAYER][0]
+    plan.player = _open_tile_near(*p_room.center(), blocked, rng)
+    occupied.add(plan.player)
+
+    b_room = [room for room in generator.room_list if room.rtype is AreaTypes.BOSS][0]
+    if last:
+        plan.boss = _open_tile_near(*b_room.center(), blocked, rng)
+        occupied.add(plan.boss)
+    else:
+        plan.stairs = _open_tile_near(*b_room.center(), blocked, rng)
+
+    # monsters: at most one per room and pass, preferring rooms with obstacles
+    monsters_left = constants.MONSTER_COUNT
+    while monsters_left > 0:
+        for room in generator.room_list:
+            if room is p_room:
+                continue
+            monsters = rng.randint(0, min(monsters_left, 1))
+            monsters_left -= monsters
+            if not monsters or not(room.obstacles or rng.randint(0,2) == 2):
+                continue
+
+            for tries in range(100):
+                x = rng.randint(room.x - room.w + 1, room.x + room.w - 1)
+                y = rng.randint(room.y - room.h + 1, room.y + room.h - 1)
+                if blocked(x, y):
+                    continue
+
+                kind = SCOUT
+                if rng.uniform(0, 1) < constants.MONSTER_SPECIAL:
+                    if rng.uniform(0, 1) < constants.MONSTER_BARD:
+                        kind = BARD
+                    elif rng.uniform(0, 1) < constants.MONSTER_TOUGH:
+                        kind = WARRIOR
+                    else:
+                        kind = None
+                if kind:
+                    plan.monsters.append((kind, x, y))
+                    occupied.add((x, y))
+                break
+
+    # items dropped by fighters, no fighter carries two of a kind
+    fighters = len(plan.monsters) + (1 if plan.boss else 0)
+    num_items = constants.ITEM_QTY if fighters else 0
+    while num_items > 0:
+        carried = plan.drops.setdefault(rng.randrange(fighters), [])
+        add_items = True
+        while add_items:
+            item = rng.randrange(ITEM_KINDS)
+            tries = 0
+            while item in carried and tries < 20:
+                item = rng.randrange(ITEM_KINDS)
+                tries += 1
+            if item in carried:
+                break
+            carried.append(item)
+            num_items -= 1
+            add_items = num_items > 0 and rng.randint(0,100) < 5
+
+    return plan
+
+"""
+Generate and plan a whole floor from its seed. Checks 'cancelled' (a threading.Event)
+between steps and gives up early, returning None, once it is set
+"""
+def make_floor(floor, seed, last, cancelled=None):
+    generator = make_generator(seed=seed, **default_generator_args())
+    if constants.LEVEL_SEED is not None:
+        LevelCache().gen_valid_level(generator)
+    else:
+        generator.gen_valid_level()
+
+    if cancelled and cancelled.is_set():
+        return None
+
+    # population draws from its own stream, never from the global RNG the main thread uses
+    rng = random.Random(repr((seed, 'population')))
+    plan = plan_floor(generator, floor, last, rng, seed)
+    logging.info('Prepared floor %s: %s', floor, plan)
+    return plan
+
+"""
+Prepares the next floor on a background thread while the current one is played
+"""
+class FloorBuilder:
+    def __init__(self):
+        self.executor = None
+        self.future = None
+        self.floor = None
+        self.cancelled = None
+
+    """
+    Start making floor in the background, replacing any floor already being made
+    """
+    def request(self, floor, seed, last):
+        self.cancel()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='FloorBuilder')
+
+        self.floor = floor
+        self.cancelled = threading.Event()
+        self.future = self.executor.submit(make_floor, floor, seed, last, self.cancelled)
+
+    def ready(self):
+        return self.future is not None and self.future.done()
+
+    """
+    Return the FloorPlan for floor, waiting for it if it isn't done yet.
+    None if that floor was never requested or making it failed
+    """
+    def take(self, floor):
+        if self.future is None or self.floor != floor:
+            return None
+
+        future = self.future
+        self.future = None
+        if not future.done():
+            logging.info('Waiting for floor %s...', floor)
+        try:
+            return future.result()
+        except Exception:
+            logging.exception('Preparing floor %s failed', floor)
+            return None
+
+    def cancel(self):
+        if self.future is None:
+            return
+        self.cancelled.set()
+        self.future.cancel()
+        self.future = None
+        self.floor = None
+
+    def shutdown(self):
+        self.cancel()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import tcod.constants
+import tcod.map
+
+import constants
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# FOV algorithm names used in constants (same names tdl.map.quickFOV took)
+ALGORITHMS = {
+    'BASIC': tcod.constants.FOV_BASIC,
+    'DIAMOND': tcod.constants.FOV_DIAMOND,
+    'SHADOW': tcod.constants.FOV_SHADOW,
+    'PERMISSIVE': tcod.constants.FOV_PERMISSIVE_8,
+    'RESTRICTIVE': tcod.constants.FOV_RESTRICTIVE,
+}
+
+"""
+Bool [x, y] mask of the tiles of a TileMap visible from x, y, computed by libtcod in one call
+from the map's arrays. Sight is always cut to the circle dx*dx + dy*dy <= radius*radius (like
+quickFOV with sphere=True), whatever the algorithm or radius
+"""
+def compute_fov(tiles, x, y, radius, algorithm=constants.FOV_ALGO, light_walls=True):
+    # light passes through tiles that neither block nor block sight
+    transparency = tiles.transparent & ~tiles.blocked
+    reach = int(np.ceil(radius))
+    mask = tcod.map.compute_fov(transparency, (x, y), radius=reach, light_walls=light_walls,
+                                algorithm=ALGORITHMS[algorithm])
+    # not every algorithm keeps to a circle on its own (BASIC and PERMISSIVE reach the corners)
+    xs = np.arange(tiles.width)[:, None] - x
+    ys = np.arange(tiles.height)[None, :] - y
+    mask &= xs * xs + ys * ys <= radius * radius
+    return mask
+
+"""
+A computed field of view. 'mask' is the bool [x, y] array; (x, y) in view, iteration and len()
+work like the set of tiles quickFOV used to return, and 'tiles' is that set (built on first use)
+"""
+class FieldOfView:
+    def __init__(self, tiles, x, y, radius, algorithm=constants.FOV_ALGO, light_walls=True):
+        self.mask = compute_fov(tiles, x, y, radius, algorithm, light_walls)
+        self._tiles = None
+
+    @property
+    def tiles(self):
+        if self._tiles is None:
+            self._tiles = set(zip(*(axis.tolist() for axis in np.nonzero(self.mask))))
+        return self._tiles
+
+    def __contains__(self, tile):
+        x, y = tile
+        w, h = self.mask.shape
+        return 0 <= x < w and 0 <= y < h and bool(self.mask[x, y])
+
+    def __iter__(self):
+        return iter(self.tiles)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.mask))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+
+import constants
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+"""
+Least recently used cache of field of view results keyed by (x, y, radius, terrain version).
+A TileMap gets a new version whenever its terrain changes, so stale views are never returned
+and simply age out
+"""
+class FovCache:
+    def __init__(self, size=constants.FOV_CACHE_SIZE):
+        self.size = size
+        self.views = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Visible tiles from x, y: the cached view if there is one, otherwise compute(x, y, radius).
+    Views are shared between callers, don't modify them
+    """
+    def get(self, x, y, radius, version, compute):
+        key = (x, y, radius, version)
+        view = self.views.get(key)
+        if view is not None:
+            self.views.move_to_end(key)
+            self.hits += 1
+            return view
+
+        self.misses += 1
+        view = compute(x, y, radius)
+        self.views[key] = view
+        if len(self.views) > self.size:
+            self.views.popitem(last=False)
+        return view
+
+    def clear(self):
+        self.views.clear()
+
+    def __repr__(self):
+        total = self.hits + self.misses
+        return '<FovCache {0} views, {1} hits, {2} misses ({3:.0%} hit rate)>'.format(
+            len(self.views), self.hits, self.misses, self.hits / total if total else 0)
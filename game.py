@@ -9,8 +9,10 @@ import shelve
 
 import constants
 import dungeon
+import fov
 import colors
 import controls
+import level_supply
 
 import time
 
@@ -56,6 +58,9 @@ class Game:
         
         self.menu_invoked = False
         
+        # background generator of validated levels (started with the game)
+        self.level_supply = None
+        
         # map x,y tile of camera position (should center on player)
         self.camera_x = 0
         self.camera_y = 0
@@ -65,10 +70,6 @@ class Game:
         
         if self.dungeon and self.dungeon.player and not self.dungeon.player.fighter.died and self.dungeon.player.fighter.hp > 0:
         
-            # clear dungeon reference from objects (we re-set upon load)
-            for obj in self.dungeon.objects:
-                obj.dungeon = None
-            
             # open a new empty shelve (possibly overwriting an old one) to write the game data
             with shelve.open('savegame', 'n') as savefile:
                 savefile['map'] = self.dungeon.map
@@ -84,6 +85,7 @@ class Game:
                 savefile['player_turn'] = self.dungeon.player_turn
                 
                 savefile['killed_boss'] = self.dungeon.killed_boss
+                savefile['level'] = self.dungeon.level
                 
                 # save the turn schedule as: k=ticks, v=(array of obj index)
                 sch = dict()
@@ -116,6 +118,7 @@ class Game:
         self.root_console.clear()
         
         if self.dungeon:
+            self.dungeon.close()
             del self.dungeon
         
         self.dungeon = dungeon.Dungeon(self)
@@ -126,7 +129,9 @@ class Game:
             with shelve.open('savegame', 'r') as savefile:
                 if savefile:
                     self.dungeon.map = savefile['map']
+                    self.dungeon.fov_cache.clear()
                     self.dungeon.objects = savefile['objects']
+                    self.dungeon.reindex_objects()
                     self.dungeon.player = self.dungeon.objects[savefile['player_index']]  #get index of player in objects list and access it
                     self.dungeon.inventory = savefile['inventory']
                     self.messages = savefile['messages']
@@ -138,6 +143,7 @@ class Game:
                     self.dungeon.player_turn = savefile['player_turn']
                     
                     self.dungeon.killed_boss = savefile['killed_boss']
+                    self.dungeon.level = savefile.get('level', 1)
                     
                     # load the turn schedule as: k=ticks, v=(array of obj index)
                     logging.info(str(savefile['schedule']))
@@ -154,6 +160,9 @@ class Game:
                     # fix enemy count
                     self.dungeon.count_enemies()
                     
+                    # the floor below isn't saved, start making it again
+                    self.dungeon.prepare_next_floor()
+                    
                     # determine current state
                     if self.dungeon.player.fighter.hp < 1:
                         self.state = constants.STATE_DEAD
@@ -174,6 +183,7 @@ class Game:
         
         if self.dungeon:
             self.map_console.clear()
+            self.dungeon.close()
             del self.dungeon
             
         self.root_console.clear()
@@ -185,7 +195,7 @@ class Game:
      
         #generate map (at this point it's not drawn to the screen)
         self.dungeon.create_player()
-        self.dungeon.make_map()
+        self.dungeon.make_map(constants.LEVEL_SEED)
      
         self.state = constants.STATE_PLAYING
      
@@ -249,7 +259,7 @@ class Game:
                     #avoid numpad's numlock-on multi key press sending 2 keys to repeat the action
                     moved = desc in [constants.MOVE_1, constants.MOVE_2, constants.MOVE_3, constants.MOVE_4, 
                         constants.MOVE_6, constants.MOVE_7, constants.MOVE_8, constants.MOVE_9]
-                    if moved or desc in [constants.PICK_UP, constants.DROP, constants.INVENTORY, constants.WAIT]:
+                    if moved or desc in [constants.PICK_UP, constants.DROP, constants.INVENTORY, constants.WAIT, constants.DESCEND]:
                         picked_up = False
                         # evaluate delayed actions (selection screens mostly)
                         if moved:
@@ -262,6 +272,8 @@ class Game:
                             self.do_inventory_use(action)
                         elif desc == constants.WAIT:
                             self.dungeon.player_wait()
+                        elif desc == constants.DESCEND:
+                            self.do_descend(action)
                             
                         #report item names on tile if applicable
                         if moved or picked_up:
@@ -332,6 +344,10 @@ class Game:
         y += 1
         title = '* Press "i" for inventory'
         instr_console.draw_str(title_center, y, title, bg=None, fg=text_color)
+        # > on stairs
+        y += 1
+        title = '* Press ">" on stairs to go down'
+        instr_console.draw_str(title_center, y, title, bg=None, fg=text_color)
             
         return instr_console
     
@@ -451,8 +467,17 @@ class Game:
         
         tdl.setFPS(constants.LIMIT_FPS)
         
+        # start generating levels in the background
+        self.level_supply = level_supply.LevelSupply()
+        self.level_supply.start()
+        
         ### start main menu ###
-        self.main_menu()
+        try:
+            self.main_menu()
+        finally:
+            if self.dungeon:
+                self.dungeon.close()
+            self.level_supply.stop()
         
         
     ### MESSAGES LOG ###
@@ -679,17 +704,17 @@ class Game:
                 last_coord = self.mouse_coord
                 if (x,y) in self.dungeon.visible_tiles:
                     # render new target area
-                    if not(self.dungeon.map[x][y].blocked) and (not(max_range) or (self.dungeon.distance(self.dungeon.player.x, self.dungeon.player.y, x, y) <= max_range)):
+                    if not(self.dungeon.map.blocked[x, y]) and (not(max_range) or (self.dungeon.distance(self.dungeon.player.x, self.dungeon.player.y, x, y) <= max_range)):
                         self.map_console.draw_char(x, y, None, fg=None, bg=constants.color_target)
                         logging.debug('drew to %s',last_coord)
                         if target_size > 0:
                             #target on map
-                            target = tdl.map.quickFOV(x, y, self.dungeon.is_visible_tile,
-                                                         fov=constants.FOV_BASIC,
+                            target = fov.FieldOfView(self.dungeon.map, x, y,
                                                          radius=target_size,
-                                                         lightWalls=False)
+                                                         algorithm=constants.FOV_BASIC,
+                                                         light_walls=False)
                             for tile in target:
-                                if not self.dungeon.map[tile[0]][tile[1]].blocked and tile in self.dungeon.visible_tiles:
+                                if not self.dungeon.map.blocked[tile] and tile in self.dungeon.visible_tiles:
                                     self.map_console.draw_char(tile[0], tile[1], None, fg=None, bg=constants.color_target)
             
             # rendering background (overwrite previous target squares)
@@ -712,7 +737,9 @@ class Game:
         
     def get_obj_names_at(self, x, y, use_article=False):
         #create a list with the names of all objects at the mouse's coordinates and in FOV
-        names = [obj.name for obj in self.dungeon.objects if (obj.x, obj.y) == (x,y) and (obj.x, obj.y) in self.dungeon.visible_tiles]
+        names = []
+        if (x, y) in self.dungeon.visible_tiles:
+            names = [obj.name for obj in self.dungeon.objects_at(x, y)]
         # if names:
             # logging.info(str(names))
         names = ', '.join(names)  #join the names, separated by commas
@@ -723,7 +750,7 @@ class Game:
         return names
         
     def get_items_at(self, x, y):
-        return [obj.item for obj in self.dungeon.objects if (obj.x, obj.y) == (x,y) and obj.item and not(obj.fighter)]
+        return [obj.item for obj in self.dungeon.objects_at(x, y) if obj.item and not(obj.fighter)]
         
     def get_item_names_at(self, x, y):
         #create a list with the names of all Items at the mouse's coordinates and in FOV
@@ -734,28 +761,6 @@ class Game:
         else:
             return None
             
-    def sort_obj_at(self, x, y):
-        junk = []
-        items = []
-        ftrs = []
-        
-        for obj in self.dungeon.objects:
-            if (obj.x, obj.y) == (x,y):
-                if obj.fighter:
-                    ftrs.append(obj)
-                elif obj.item:
-                    items.append(obj)
-                else:
-                    junk.append(obj)
-        # send to back in reverse order to sort
-        for f in ftrs:
-            self.dungeon.send_to_back(f)
-        for i in items:
-            self.dungeon.send_to_back(i)
-        for j in junk:
-            self.dungeon.send_to_back(j)
-            
-        
     def target_monster(self, max_range=None):
         #returns a clicked monster inside FOV up to a range, or None if right-clicked
         while True:
@@ -764,8 +769,8 @@ class Game:
                 return None
      
             #return the first clicked monster, otherwise continue looping
-            for obj in self.dungeon.objects:
-                if obj.x == x and obj.y == y and obj.fighter and obj != self.dungeon.player:
+            for obj in self.dungeon.objects_at(x, y):
+                if obj.fighter and obj != self.dungeon.player:
                     return obj
  
     
@@ -848,6 +853,9 @@ class Game:
                 elif controls.inventory(user_input):
                     #show the inventory; if an item is selected, use it
                     return TurnEvent(0, constants.INVENTORY)
+                # take the stairs down
+                elif controls.descend(user_input):
+                    return TurnEvent(0, constants.DESCEND)
                 else:
                     return #invalid key: didnt-take-turn
                 
@@ -865,8 +873,8 @@ class Game:
     def do_pickup(self, turn_action):
         #pick up items here
         found = []
-        for obj in self.dungeon.objects:  #look for any items in player's tile
-            if obj.x == self.dungeon.player.x and obj.y == self.dungeon.player.y and obj.item:
+        for obj in self.dungeon.objects_at(self.dungeon.player.x, self.dungeon.player.y):  #look for any items in player's tile
+            if obj.item:
                 logging.info('Pickup SUCCESS: %s at %s', obj.name, (obj.x, obj.y))
                 found.append(obj)
                 
@@ -884,6 +892,19 @@ class Game:
             if chosen_item.use():
                 turn_action.turns_used = self.dungeon.player.fighter.speed
         
+    def do_descend(self, turn_action):
+        if not self.dungeon.stairs_at(self.dungeon.player.x, self.dungeon.player.y):
+            self.message('There are no stairs here.')
+            return
+        if self.dungeon.descend():
+            turn_action.turns_used = self.dungeon.player.fighter.move_speed()
+            self.map_console.clear()
+            self.fov_recompute = True
+            if self.dungeon.last_floor():
+                self.message('You creep down to the deepest hall. Beowulf is here somewhere...', colors.light_flame)
+            else:
+                self.message('You creep down the stairs, deeper into Heorot.', colors.light_flame)
+        
     def do_move(self, turn_action):
         turn_action.turns_used = self.dungeon.player_move_or_attack(turn_action.move_x, turn_action.move_y)
     
@@ -991,43 +1012,38 @@ class Game:
         # recompute fov if required
         if self.fov_recompute:
             self.fov_recompute = False
-            self.dungeon.visible_tiles = tdl.map.quickFOV(self.dungeon.player.x, self.dungeon.player.y,
-                                             self.dungeon.is_visible_tile,
-                                             fov=constants.FOV_ALGO,
+            self.dungeon.visible_tiles = fov.FieldOfView(self.dungeon.map, self.dungeon.player.x, self.dungeon.player.y,
                                              radius=self.dungeon.player.fov,
-                                             lightWalls=constants.FOV_LIGHT_WALLS)
+                                             algorithm=constants.FOV_ALGO,
+                                             light_walls=constants.FOV_LIGHT_WALLS)
+            # everything in view is explored
+            self.dungeon.map.explore(self.dungeon.visible_tiles.mask)
         
         # draw frame around map
         self.map_console.draw_frame(0, 0, self.map_console.width, self.map_console.height, string=None, fg=None, bg=constants.color_frame)
         
         #go through all tiles in camera view, and set their background color according to the FOV
+        tiles = self.dungeon.map
+        view = (self.camera_x + 1, self.camera_y + 1,
+                self.camera_x + constants.CAMERA_WIDTH - 1, self.camera_y + constants.CAMERA_HEIGHT - 1)
+        # background colours of the whole view, one palette lookup each
+        light = tiles.light_colors(*view).tolist()
+        dark = tiles.dark_colors(*view).tolist()
+        explored = tiles.explored_block(*view).tolist()
+        in_view = self.dungeon.visible_tiles.mask[view[0]:view[2], view[1]:view[3]].tolist()
         for y in range(1, constants.CAMERA_HEIGHT-1):
             for x in range(1, constants.CAMERA_WIDTH-1):
-                map_x, map_y = (self.camera_x + x, self.camera_y + y)
-                visible = (map_x, map_y) in self.dungeon.visible_tiles
-                wall = self.dungeon.map[map_x][map_y].block_sight
-                if not visible:
+                if not in_view[x-1][y-1]:
                     #if it's not visible right now, the player can only see it 
                     #if it's explored
-                    if self.dungeon.map[map_x][map_y].explored:
-                        self.map_console.draw_char(x, y, None, fg=None, bg=self.dungeon.map[map_x][map_y].color_dark)
-                        # if wall:
-                            # self.map_console.draw_char(x, y, None, fg=None, bg=constants.color_dark_wall)
-                        # else:
-                            # self.map_console.draw_char(x, y, None, fg=None, bg=constants.color_dark_ground)
+                    if explored[x-1][y-1]:
+                        self.map_console.draw_char(x, y, None, fg=None, bg=dark[x-1][y-1])
                 else:
-                    # if wall:
-                        # self.map_console.draw_char(x, y, None, fg=None, bg=constants.color_light_wall)
-                    # else:
-                        # self.map_console.draw_char(x, y, None, fg=None, bg=constants.color_light_ground)
-                    self.map_console.draw_char(x, y, None, fg=None, bg=self.dungeon.map[map_x][map_y].color_light)
-                    
-                    #since it's visible, explore it
-                    self.dungeon.map[map_x][map_y].explored = True
+                    self.map_console.draw_char(x, y, None, fg=None, bg=light[x-1][y-1])
      
-        #draw all objects in the list
-        for obj in self.dungeon.objects:
-            self.draw_obj(obj)
+        #draw the top object of each tile's stack
+        for stack in self.dungeon.tile_objects.values():
+            self.draw_obj(stack[-1])
         
         #blit the contents of "self.map_console" to the self.root_console console and present it
         self.root_console.blit(self.map_console, constants.CAMERA_PANEL_X, constants.CAMERA_PANEL_Y, constants.CAMERA_WIDTH, constants.CAMERA_HEIGHT, 0, 0)
@@ -1101,6 +1117,9 @@ class Game:
         # time
         y += 1
         self.status_panel.draw_str(x, y, self.dungeon.time_string, bg=None, fg=colors.light_grey)
+        # floor
+        y += 1
+        self.status_panel.draw_str(x, y, 'Floor ' + str(self.dungeon.level) + ' of ' + str(constants.FLOOR_COUNT), bg=None, fg=colors.light_grey)
         
         # draw inventory counts
         y += 4
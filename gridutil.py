@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+"""
+Return a copy of the 2d boolean array 'mask' grown by one tile in all 8 directions
+(tiles outside the array are treated as False)
+"""
+def dilate(mask):
+    h, w = mask.shape
+    padded = np.zeros((h + 2, w + 2), dtype=bool)
+    padded[1:-1, 1:-1] = mask
+
+    grown = np.zeros_like(mask, dtype=bool)
+    for dy in range(3):
+        for dx in range(3):
+            grown |= padded[dy:dy + h, dx:dx + w]
+    return grown
+
+"""
+Return (labels, count) for the 8-connected regions of True tiles in the 2d boolean array 'mask'.
+labels is an int32 array where 0 marks False tiles and each region gets its own number 1..count
+"""
+def label_regions(mask):
+    h, w = mask.shape
+    size = h * w
+    index = np.arange(size).reshape(h, w)
+
+    # pairs of neighbouring open tiles: right, down, down-right and down-left
+    src = []
+    dst = []
+    for a, b in (((slice(None), slice(None, -1)), (slice(None), slice(1, None))),
+                 ((slice(None, -1), slice(None)), (slice(1, None), slice(None))),
+                 ((slice(None, -1), slice(None, -1)), (slice(1, None), slice(1, None))),
+                 ((slice(None, -1), slice(1, None)), (slice(1, None), slice(None, -1)))):
+        linked = mask[a] & mask[b]
+        src.append(index[a][linked])
+        dst.append(index[b][linked])
+    src = np.concatenate(src)
+    dst = np.concatenate(dst)
+
+    # every tile starts as its own root; repeatedly hook the larger of two
+    # neighbouring roots onto the smaller one, then flatten the trees
+    parent = np.arange(size)
+    while True:
+        root_a = parent[src]
+        root_b = parent[dst]
+        differ = root_a != root_b
+        if not differ.any():
+            break
+        np.minimum.at(parent, np.maximum(root_a, root_b)[differ], np.minimum(root_a, root_b)[differ])
+        while True:
+            grand = parent[parent]
+            if (grand == parent).all():
+                break
+            parent = grand
+
+    # renumber regions 1..count
+    flat_mask = mask.ravel()
+    roots, numbered = np.unique(parent[flat_mask], return_inverse=True)
+    result = np.zeros(size, dtype=np.int32)
+    result[flat_mask] = numbered.ravel() + 1
+    return result.reshape(h, w), len(roots)
+
+# neighbour offsets (dy, dx), in the bit order used by neighbour_codes
+NEIGHBOURS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+
+"""
+Return a uint8 array with, for each tile, one bit per True neighbour in the order of NEIGHBOURS
+(tiles outside the array are treated as False)
+"""
+def neighbour_codes(mask):
+    h, w = mask.shape
+    padded = np.zeros((h + 2, w + 2), dtype=bool)
+    padded[1:-1, 1:-1] = mask
+
+    codes = np.zeros(mask.shape, dtype=np.uint8)
+    for bit, (dy, dx) in enumerate(NEIGHBOURS):
+        codes |= padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w].astype(np.uint8) << bit
+    return codes
+
+def _removable_table():
+    table = np.zeros(256, dtype=bool)
+    for code in range(256):
+        cells = [NEIGHBOURS[bit] for bit in range(8) if code >> bit & 1]
+        # count the 8-connected groups the neighbours form among themselves
+        groups = 0
+        seen = set()
+        for cell in cells:
+            if cell in seen:
+                continue
+            groups += 1
+            stack = [cell]
+            seen.add(cell)
+            while stack:
+                y, x = stack.pop()
+                for other in cells:
+                    if other not in seen and abs(other[0] - y) <= 1 and abs(other[1] - x) <= 1:
+                        seen.add(other)
+                        stack.append(other)
+        table[code] = groups <= 1
+    return table
+
+# REMOVABLE[code] is True when a tile whose neighbours are 'code' can be blocked
+# without splitting them, i.e. it is not an articulation point of the grid
+REMOVABLE = _removable_table()
+
+"""
+Return a boolean array, True where a True tile of 'mask' can be set False without
+splitting the 8-connected region it belongs to. Only holds for one tile at a time:
+tiles blocked together must be at least 3 apart on some axis
+"""
+def removable(mask):
+    return mask & REMOVABLE[neighbour_codes(mask)]
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import mmap
+import struct
+
+import numpy as np
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+"""
+Binary archive of many generated levels in one file, for analysing and replaying levels.
+
+Layout (little endian):
+    header     magic, format version, generator version, level count, index offset
+    level data the arrays of Generator.export_level for each level, 8 byte aligned
+    index      one INDEX_DTYPE record per level: seed, validity and where each array lives
+
+Readers memory-map the file and get each level's arrays as read-only views into it
+"""
+
+MAGIC = b'GRNDLVLA'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<8sIIQQ')
+
+# arrays stored for each level, with their dtypes (as produced by Generator.export_level)
+ARRAYS = (('grid', np.uint8), ('rooms', np.int16), ('obstacles', np.int16),
+          ('corridors', np.int16), ('regions', np.int16))
+
+INDEX_DTYPE = np.dtype([('seed', '<i8'), ('valid', 'u1')] +
+                       [(name + '_offset', '<u8') for name, dtype in ARRAYS] +
+                       [(name + '_shape', '<u4', (2,)) for name, dtype in ARRAYS])
+
+"""
+Writes levels to a new archive file, use as a context manager or call close() when done
+"""
+class LevelArchiveWriter:
+    def __init__(self, path, generator_version=None):
+        self.path = path
+        self.generator_version = generator_version or 0
+        self.records = []
+
+        self.file = open(path, 'wb')
+        # header is rewritten with the real count and index offset on close
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, self.generator_version, 0, 0))
+
+    def _align(self):
+        pad = -self.file.tell() % 8
+        if pad:
+            self.file.write(b'\0' * pad)
+
+    """
+    Append a level as exported by Generator.export_level, return its index in the archive
+    """
+    def add(self, level, seed=None, valid=True):
+        record = np.zeros((), dtype=INDEX_DTYPE)
+        record['seed'] = -1 if seed is None else seed
+        record['valid'] = valid
+        for name, dtype in ARRAYS:
+            array = np.ascontiguousarray(level[name], dtype=dtype)
+            self._align()
+            record[name + '_offset'] = self.file.tell()
+            record[name + '_shape'] = array.shape
+            self.file.write(array.tobytes())
+        self.records.append(record)
+        return len(self.records) - 1
+
+    """
+    Append the generator's current level (and its seed, if any)
+    """
+    def add_generator(self, generator, valid=True):
+        return self.add(generator.export_level(), generator.seed, valid)
+
+    def close(self):
+        if self.file is None:
+            return
+        self._align()
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.records, dtype=INDEX_DTYPE).tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, self.generator_version, len(self.records), index_offset))
+        self.file.close()
+        self.file = None
+        logging.info('Wrote %s levels to %s', len(self.records), self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+"""
+Memory-mapped, read-only view of an archive written by LevelArchiveWriter.
+archive[i] returns level i as a dict of arrays that point straight into the file
+"""
+class LevelArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, fmt, self.generator_version, count, index_offset = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a level archive!', path)
+        if fmt != FORMAT_VERSION:
+            raise ValueError('Unsupported level archive version!', fmt)
+
+        self.index = np.frombuffer(self.mm, dtype=INDEX_DTYPE, count=count, offset=index_offset)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        record = self.index[i]
+        level = {}
+        for name, dtype in ARRAYS:
+            shape = tuple(int(n) for n in record[name + '_shape'])
+            level[name] = np.frombuffer(self.mm, dtype=dtype, count=shape[0] * shape[1],
+                                        offset=int(record[name + '_offset'])).reshape(shape)
+        return level
+
+    def seed(self, i):
+        seed = int(self.index[i]['seed'])
+        return None if seed < 0 else seed
+
+    def valid(self, i):
+        return bool(self.index[i]['valid'])
+
+    """
+    Load level i into generator (see Generator.import_level)
+    """
+    def load(self, i, generator):
+        generator.import_level(self[i])
+        generator.seed = self.seed(i)
+
+    def close(self):
+        if self.mm is None:
+            return
+        self.index = None
+        try:
+            self.mm.close()
+        except BufferError:
+            # level arrays handed out are still alive, the map is freed along with them
+            pass
+        self.mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+
+import numpy as np
+
+import constants
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+"""
+On-disk cache of finished, validated levels keyed by (seed, generator parameters).
+Each level is stored as a compressed .npz of the arrays from Generator.export_level
+"""
+class LevelCache:
+    def __init__(self, directory=constants.LEVEL_CACHE_DIR):
+        self.directory = directory
+
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Content address of the level a generator produces from its seed
+    """
+    def key(self, generator):
+        ident = repr((generator.seed, generator.params()))
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def path(self, generator):
+        return os.path.join(self.directory, self.key(generator) + '.npz')
+
+    """
+    Load the cached level for the generator's seed into generator, return True if found
+    """
+    def load(self, generator):
+        try:
+            with np.load(self.path(generator)) as data:
+                generator.import_level(data)
+            return True
+        except (OSError, KeyError, ValueError):
+            return False
+
+    def save(self, generator):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(generator)
+        # write to a temp file first so readers never see a half written level
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **generator.export_level())
+        os.replace(tmp_path, path)
+
+    """
+    Fill generator with the valid level for its seed, from the cache if possible.
+    Returns the number of generation tries used (0 for a cache hit)
+    """
+    def gen_valid_level(self, generator):
+        if generator.seed is None:
+            # nothing to key the level on
+            return generator.gen_valid_level()
+
+        if self.load(generator):
+            self.hits += 1
+            return 0
+
+        self.misses += 1
+        generator.reseed(generator.seed)
+        tries = generator.gen_valid_level()
+        self.save(generator)
+        logging.info('Cached level for seed %s (%s tries)', generator.seed, tries)
+        return tries
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import queue
+
+import constants
+
+from dungeon_generator import Generator
+from cave_generator import CaveGenerator
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+"""
+Generator arguments used for every level in the game
+"""
+def default_generator_args():
+    return dict(width=constants.MAP_WIDTH, height=constants.MAP_HEIGHT,
+                max_rooms=constants.MAX_ROOMS, min_room_xy=constants.ROOM_MIN_SIZE,
+                max_room_xy=constants.ROOM_MAX_SIZE)
+
+"""
+New level generator for the given layout style (constants.LEVEL_STYLE by default)
+"""
+def make_generator(style=None, **generator_args):
+    if (style or constants.LEVEL_STYLE) == 'caves':
+        return CaveGenerator(**generator_args)
+    return Generator(**generator_args)
+
+"""
+Worker process body: keep the levels queue topped up with validated levels until stopped
+"""
+def _supply_worker(levels, stop_event, generator_args):
+    # unseeded, so each worker's generator draws its own random state
+    gen = make_generator(**generator_args)
+
+    while not stop_event.is_set():
+        gen.gen_valid_level()
+        level = gen.export_level()
+
+        # wait for room in the queue, checking for stop now and then
+        while not stop_event.is_set():
+            try:
+                levels.put(level, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+
+"""
+Keeps a bounded queue of already validated levels, generated by background worker processes
+"""
+class LevelSupply:
+    def __init__(self, size=constants.LEVEL_SUPPLY_SIZE, workers=constants.LEVEL_SUPPLY_WORKERS,
+                 generator_args=None):
+        self.size = size
+        self.workers = workers
+        self.generator_args = generator_args or default_generator_args()
+
+        self.levels = None
+        self.stop_event = None
+        self.processes = []
+
+    def running(self):
+        return len(self.processes) > 0
+
+    def start(self):
+        if self.running():
+            return
+
+        self.levels = multiprocessing.Queue(self.size)
+        self.stop_event = multiprocessing.Event()
+        for i in range(self.workers):
+            p = multiprocessing.Process(target=_supply_worker, name='LevelSupply-' + str(i),
+                                        args=(self.levels, self.stop_event, self.generator_args))
+            p.daemon = True
+            p.start()
+            self.processes.append(p)
+        logging.info('Level supply started with %s workers', self.workers)
+
+    """
+    Return an exported level (see Generator.export_level) if one is ready, otherwise None
+    """
+    def get(self):
+        if not self.running():
+            return None
+        try:
+            return self.levels.get_nowait()
+        except queue.Empty:
+            logging.info('Level supply empty')
+            return None
+
+    def stop(self):
+        if not self.running():
+            return
+
+        self.stop_event.set()
+        # drain the queue so workers blocked on a full queue can exit
+        try:
+            while True:
+                self.levels.get_nowait()
+        except queue.Empty:
+            pass
+
+        for p in self.processes:
+            p.join(timeout=1.0)
+            if p.is_alive():
+                p.terminate()
+        self.processes = []
+
+        self.levels.close()
+        self.levels = None
+        self.stop_event = None
+        logging.info('Level supply stopped')
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Room templates the generator can stamp instead of a plain rectangle.
+
+    .   floor
+    #   wall
+    o   obstacle (pillars, statues...)
+
+Every template is a full rectangle whose outer ring is floor, so corridors can reach it from
+any side, and whose floor is all connected. dungeon_generator compiles them into tile arrays
+and checks both rules when it is imported.
+
+'room' templates replace ordinary rooms, 'arena' templates replace the big boss rooms
+"""
+
+ROOM = 'room'
+ARENA = 'arena'
+
+TEMPLATES = {
+    'pillared hall': (ROOM, [
+        '...........',
+        '.o.o.o.o.o.',
+        '...........',
+        '...........',
+        '.o.o.o.o.o.',
+        '...........',
+    ]),
+    'vault': (ROOM, [
+        '.........',
+        '.#######.',
+        '.#.....#.',
+        '.#.o.o.#.',
+        '.#.....#.',
+        '.#.o.o.#.',
+        '.#.....#.',
+        '.###.###.',
+        '.........',
+    ]),
+    'shrine': (ROOM, [
+        '.......',
+        '.o...o.',
+        '...o...',
+        '..ooo..',
+        '...o...',
+        '.o...o.',
+        '.......',
+    ]),
+    'ring of pillars': (ARENA, [
+        '............',
+        '............',
+        '..o..oo..o..',
+        '............',
+        '..o......o..',
+        '..o......o..',
+        '..o......o..',
+        '..o......o..',
+        '............',
+        '..o..oo..o..',
+        '............',
+        '............',
+    ]),
+    'mead hall': (ARENA, [
+        '............',
+        '.o.o.o.o.o..',
+        '............',
+        '....####....',
+        '....#..#....',
+        '....#..#....',
+        '............',
+        '.o.o.o.o.o..',
+        '............',
+    ]),
+}
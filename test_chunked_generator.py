@@ -0,0 +1,22 @@
+import numpy as np
+
+import gridutil
+from chunked_generator import ChunkedLevel
+from dungeon_generator import TILE_BLOCKED
+
+# every walkable tile of a fully generated chunked map should be one connected area
+def test_chunked_level_is_connected():
+    for seed in range(4):
+        level = ChunkedLevel(1000, 1000, seed=seed)
+        labels, count = gridutil.label_regions(~TILE_BLOCKED[level.window(0, 0, 1000, 1000)])
+        assert count == 1, (seed, count, np.bincount(labels.ravel())[1:].tolist())
+
+# a chunk comes out the same whatever order the chunks are generated in
+def test_chunks_independent_of_order():
+    forward = ChunkedLevel(320, 320, seed=7)
+    backward = ChunkedLevel(320, 320, seed=7)
+    forward.window(0, 0, 320, 320)
+    for cy in reversed(range(backward.chunks_y)):
+        for cx in reversed(range(backward.chunks_x)):
+            backward.get_chunk(cx, cy)
+    assert np.array_equal(forward.window(0, 0, 320, 320), backward.window(0, 0, 320, 320))
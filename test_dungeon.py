@@ -0,0 +1,140 @@
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+# the dungeon needs the game's libraries, skip these tests where they aren't installed
+pytest.importorskip('tcod')
+pytest.importorskip('tdl')
+
+import dungeon
+
+class FakeGame:
+    level_supply = None
+    fov_recompute = False
+    state = None
+
+    def message(self, *args, **kwargs):
+        pass
+
+"""
+A populated first floor from a fixed seed, with a player that can't die
+"""
+def make_dungeon(seed):
+    random.seed(seed)
+    d = dungeon.Dungeon(FakeGame())
+    d.create_player()
+    d.make_map()
+    d.player.fighter.hp = d.player.fighter.max_hp = 10 ** 9
+    return d
+
+"""
+Send every sleeping monster after the player, so they move, fight and die
+"""
+def wake_monsters(d):
+    for obj in d.objects:
+        if obj.ai and obj.ai.state == dungeon.States.SLEEP:
+            obj.ai.change_state(dungeon.States.FIGHT)
+            obj.ai.target_x = obj.ai.last_px = d.player.x
+            obj.ai.target_y = obj.ai.last_py = d.player.y
+
+"""
+Walk the player around at random (attacking whatever is in the way) with the monsters awake,
+calling check() after every turn. every(d) is called before each player move for extra actions
+"""
+def simulate(d, turns, check, every=None):
+    for t in range(turns):
+        wake_monsters(d)
+        if every:
+            every(d)
+        dx, dy = random.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+        d.player_move_or_attack(dx, dy)
+        d.player_turn = False
+        d.schedule_turn(10, d.player)
+        while not d.player_turn:
+            d.next_turn()
+        check(d)
+
+def occupancy_count(d):
+    occ = np.zeros_like(d.occupancy)
+    for obj in d.objects:
+        if obj.blocks:
+            occ[obj.x, obj.y] += 1
+    return occ
+
+# the occupancy grid always matches a count of the blocking objects
+def test_occupancy_matches_objects():
+    def check(d):
+        assert (occupancy_count(d) == d.occupancy).all()
+
+    for seed in range(2):
+        d = make_dungeon(seed)
+        check(d)
+        simulate(d, 500, check)
+        d.close()
+
+"""
+Now and then step onto an item, pick up whatever is under the player, and now and then drop
+something from the inventory
+"""
+def pick_up_and_drop(d):
+    if random.random() < 0.1:
+        items = [obj for obj in d.objects if obj.item and not d.is_blocked(obj.x, obj.y)]
+        if items:
+            item = random.choice(items)
+            d.player.move_to(item.x, item.y)
+    items = [obj for obj in d.objects_at(d.player.x, d.player.y) if obj.item]
+    if items:
+        d.pick_up(items)
+    else:
+        # (Weapon.drop takes no dropper, only plain items can be dropped this way)
+        droppable = [item for item in d.inventory if not isinstance(item, dungeon.Weapon)]
+        if droppable and random.random() < 0.2:
+            random.choice(droppable).drop(d.player)
+
+# the tile index always holds exactly the objects on each tile, in draw order
+def test_tile_index_matches_objects():
+    def check(d):
+        tiles = {}
+        for obj in d.objects:
+            tiles.setdefault((obj.x, obj.y), set()).add(id(obj))
+        assert {tile: {id(obj) for obj in stack} for tile, stack in d.tile_objects.items() if stack} == tiles
+        for stack in d.tile_objects.values():
+            layers = [dungeon.draw_layer(obj) for obj in stack]
+            assert layers == sorted(layers)
+
+    for seed in range(2):
+        d = make_dungeon(seed)
+        check(d)
+        simulate(d, 500, check, pick_up_and_drop)
+        d.close()
+
+# the pathing array always matches one rebuilt from the terrain and the blocking objects,
+# on the first floor and after going down
+def test_walkable_matches_rebuild():
+    def check(d):
+        walkable = (~d.map.blocked & (occupancy_count(d) == 0)).astype(np.int8)
+        assert (walkable == d.walkable).all()
+
+    for seed in range(2):
+        d = make_dungeon(seed)
+        check(d)
+        simulate(d, 300, check)
+        assert d.descend()
+        check(d)
+        simulate(d, 300, check)
+        d.close()
+
+# saving pickles the objects' slots, it must not make the map objects of carried weapons
+def test_pickle_keeps_weapon_owners_lazy():
+    d = make_dungeon(0)
+    simulate(d, 50, lambda d: None)
+    weapons = [obj.fighter.weapon for obj in d.objects if obj.fighter and obj.fighter.weapon]
+    carried = [weapon for weapon in weapons if weapon._owner is None]
+    assert carried
+    objects, inventory = pickle.loads(pickle.dumps((d.objects, d.inventory)))
+    assert all(weapon._owner is None for weapon in carried)
+    loaded = [obj.fighter.weapon for obj in objects if obj.fighter and obj.fighter.weapon]
+    assert sum(weapon._owner is None for weapon in loaded) == len(carried)
+    d.close()
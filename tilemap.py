@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import itertools
+
+import numpy as np
+
+from dungeon_generator import TILE_BLOCKED
+from dungeon_generator import TILE_LIGHT
+from dungeon_generator import TILE_DARK
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# terrain versions, unique across all maps (see TileMap.version)
+_versions = itertools.count(1)
+
+# default palettes: rgb background of each tile code when in view / explored but out of view
+LIGHT_PALETTE = TILE_LIGHT
+DARK_PALETTE = TILE_DARK
+
+"""
+The dungeon's tiles as parallel numpy arrays, all indexed [x, y] like the old map[x][y] lists:
+
+    blocked       bool, nothing can walk here
+    transparent   bool, light passes (not block_sight)
+    palette       uint8, row of the light and dark palettes giving the tile's colours
+
+version changes whenever blocked or transparent does (set_grid, TileView), for caches of
+results computed from the terrain; a map loaded from a save gets a new one, as the counter
+restarts in every process. explored_bits holds the tiles the player has seen packed 8 to a
+byte along y (np.packbits with axis=1). explore() ORs a whole field of view into it, the
+explored property unpacks it.
+
+Colours live only in the palettes (n x 3 uint8 arrays), so set_palette recolours every tile at
+once. map[x][y] still works and returns a TileView of one tile, for code that reads or writes
+tiles one at a time
+"""
+class TileMap:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+        # everything starts as unexplored solid rock
+        self.blocked = np.ones((width, height), dtype=bool)
+        self.transparent = np.zeros((width, height), dtype=bool)
+        self.explored_bits = np.zeros((width, (height + 7) // 8), dtype=np.uint8)
+        # palette rows are generator tile codes (0 is stone)
+        self.palette = np.zeros((width, height), dtype=np.uint8)
+        self.light_palette = LIGHT_PALETTE
+        self.dark_palette = DARK_PALETTE
+
+        self.version = next(_versions)
+
+    """
+    Map of the given size with the tiles of a generator's level grid (tile codes, indexed [y, x])
+    """
+    @classmethod
+    def from_grid(cls, grid, width=None, height=None):
+        h, w = grid.shape
+        tiles = cls(width or w, height or h)
+        tiles.set_grid(grid)
+        return tiles
+
+    """
+    Overwrite the tiles covered by a level grid, with whole-array lookups
+    """
+    def set_grid(self, grid):
+        codes = grid.T
+        w, h = codes.shape
+        self.blocked[:w, :h] = TILE_BLOCKED[codes]
+        # by default, if a tile is blocked, it also blocks sight
+        self.transparent[:w, :h] = ~self.blocked[:w, :h]
+        self.palette[:w, :h] = codes
+        self.terrain_changed()
+
+    def terrain_changed(self):
+        self.version = next(_versions)
+
+    # versions are only unique within one process, so never trust a pickled one
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.terrain_changed()
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    """
+    Bool [x, y] array of explored tiles (a fresh copy, use explore() to change it)
+    """
+    @property
+    def explored(self):
+        return np.unpackbits(self.explored_bits, axis=1, count=self.height).view(bool)
+
+    """
+    Mark a field of view as explored: a bool [x, y] mask of the map's shape, or (x, y) tiles
+    """
+    def explore(self, visible):
+        if not isinstance(visible, np.ndarray):
+            mask = np.zeros((self.width, self.height), dtype=bool)
+            tiles = np.array(list(visible), dtype=np.intp).reshape(-1, 2)
+            inside = ((tiles >= 0) & (tiles < (self.width, self.height))).all(axis=1)
+            mask[tiles[inside, 0], tiles[inside, 1]] = True
+            visible = mask
+        self.explored_bits |= np.packbits(visible, axis=1)
+
+    """
+    Bool (x1 - x0, y1 - y0) array of the explored tiles in a block of the map (e.g. the camera
+    view), unpacking only the bytes that cover it
+    """
+    def explored_block(self, x0, y0, x1, y1):
+        # clipped to the map like a slice of the other arrays
+        y1 = min(y1, self.height)
+        y0 = min(y0, y1)
+        bits = np.unpackbits(self.explored_bits[x0:x1, y0 >> 3:(y1 + 7) >> 3], axis=1)
+        start = y0 & ~7
+        return bits[:, y0 - start:y1 - start].view(bool)
+
+    def is_explored(self, x, y):
+        return bool(self.explored_bits[x, y >> 3] & (0x80 >> (y & 7)))
+
+    def set_explored(self, x, y, value=True):
+        if value:
+            self.explored_bits[x, y >> 3] |= 0x80 >> (y & 7)
+        else:
+            self.explored_bits[x, y >> 3] &= ~np.uint8(0x80 >> (y & 7))
+
+    """
+    Swap the light and/or dark palette for the whole map (e.g. to tint it), None keeps the current one
+    """
+    def set_palette(self, light=None, dark=None):
+        if light is not None:
+            self.light_palette = np.asarray(light, dtype=np.uint8)
+        if dark is not None:
+            self.dark_palette = np.asarray(dark, dtype=np.uint8)
+
+    """
+    Colours of one tile as tuples, ready for drawing
+    """
+    def light(self, x, y):
+        return tuple(self.light_palette[self.palette[x, y]].tolist())
+
+    def dark(self, x, y):
+        return tuple(self.dark_palette[self.palette[x, y]].tolist())
+
+    """
+    (x1 - x0, y1 - y0, 3) rgb planes of a block of the map (e.g. the camera view), one lookup each
+    """
+    def light_colors(self, x0, y0, x1, y1):
+        return self.light_palette[self.palette[x0:x1, y0:y1]]
+
+    def dark_colors(self, x0, y0, x1, y1):
+        return self.dark_palette[self.palette[x0:x1, y0:y1]]
+
+    def nbytes(self):
+        return (self.blocked.nbytes + self.transparent.nbytes + self.explored_bits.nbytes +
+                self.palette.nbytes)
+
+    # map[x][y] access for older code
+    def __getitem__(self, x):
+        return TileColumn(self, x)
+
+    def __len__(self):
+        return self.width
+
+"""
+One column of a TileMap, so map[x][y] keeps working
+"""
+class TileColumn:
+    __slots__ = ('tiles', 'x')
+
+    def __init__(self, tiles, x):
+        self.tiles = tiles
+        self.x = x
+
+    def __getitem__(self, y):
+        return TileView(self.tiles, self.x, y)
+
+    def __len__(self):
+        return self.tiles.height
+
+"""
+A single tile of a TileMap with the attributes the old Tile objects had. Reads and writes go
+straight to the map's arrays
+"""
+class TileView:
+    __slots__ = ('tiles', 'x', 'y')
+
+    def __init__(self, tiles, x, y):
+        self.tiles = tiles
+        self.x = x
+        self.y = y
+
+    @property
+    def blocked(self):
+        return bool(self.tiles.blocked[self.x, self.y])
+
+    @blocked.setter
+    def blocked(self, value):
+        self.tiles.blocked[self.x, self.y] = value
+        self.tiles.terrain_changed()
+
+    @property
+    def block_sight(self):
+        return not self.tiles.transparent[self.x, self.y]
+
+    @block_sight.setter
+    def block_sight(self, value):
+        self.tiles.transparent[self.x, self.y] = not value
+        self.tiles.terrain_changed()
+
+    @property
+    def explored(self):
+        return self.tiles.is_explored(self.x, self.y)
+
+    @explored.setter
+    def explored(self, value):
+        self.tiles.set_explored(self.x, self.y, value)
+
+    # colours come from the map's palettes, change the tile's palette index to recolour it
+    @property
+    def color_light(self):
+        return self.tiles.light(self.x, self.y)
+
+    @property
+    def color_dark(self):
+        return self.tiles.dark(self.x, self.y)
+
+    @property
+    def palette(self):
+        return int(self.tiles.palette[self.x, self.y])
+
+    @palette.setter
+    def palette(self, value):
+        self.tiles.palette[self.x, self.y] = value